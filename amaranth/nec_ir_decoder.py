@@ -1,8 +1,15 @@
 from amaranth import *
+from amaranth.lib.fifo import SyncFIFOBuffered
 from amaranth.sim import *
+from spi_wishbone import *
 
 
-__all__ = [ "NecIrDecoder" ]
+__all__ = [ "NecIrDecoder", "NecIrFifo" ]
+
+# registers of NecIrFifo, as word addresses on its bus
+REG_IR_DATA     = 0
+REG_IR_COUNT    = 1
+REG_IR_OVERFLOW = 2
 
 
 class PulseWidthDecoder(Elaboratable):
@@ -95,6 +102,59 @@ class NecIrDecoder(Elaboratable):
 
         return m
 
+
+class NecIrFifo(Elaboratable):
+    """
+    NEC IR decoder whose codes are queued in a FIFO readable on a Wishbone bus.
+
+    Reading REG_IR_DATA takes the oldest code out of the FIFO, or returns
+    0xFFFFFFFF if it is empty. REG_IR_COUNT holds the number of codes in
+    the FIFO, so that the host reads it, then all the codes with a single
+    fixed-address burst. REG_IR_OVERFLOW counts the codes lost because the
+    FIFO was full, and is cleared by writing it.
+    """
+
+    def __init__(self, *, freq_hz, depth=16):
+        self.depth = depth
+
+        self.irdec  = NecIrDecoder(freq_hz=freq_hz)
+        self.rx     = self.irdec.rx
+        self.bus    = WishboneInterface(addr_width=2)
+
+    def elaborate(self, platform):
+        m = Module()
+        overflow = Signal(32)
+
+        m.submodules.irdec = irdec = self.irdec
+        m.submodules.fifo = fifo = SyncFIFOBuffered(width=32, depth=self.depth)
+
+        # queue the decoded codes, counting those that do not fit
+        m.d.comb += fifo.w_data.eq(irdec.data)
+        m.d.comb += fifo.w_en.eq(irdec.valid)
+        with m.If(irdec.valid & ~fifo.w_rdy):
+            m.d.sync += overflow.eq(overflow + 1)
+
+        # registers, acknowledged on the cycle after the request
+        m.d.sync += self.bus.ack.eq(0)
+        with m.If(self.bus.cyc & self.bus.stb & ~self.bus.ack):
+            m.d.sync += self.bus.ack.eq(1)
+            with m.Switch(self.bus.adr):
+                with m.Case(REG_IR_DATA):
+                    with m.If(~self.bus.we):
+                        m.d.comb += fifo.r_en.eq(1)
+                        m.d.sync += self.bus.dat_r.eq(Mux(fifo.r_rdy, fifo.r_data, 0xFFFFFFFF))
+                with m.Case(REG_IR_COUNT):
+                    m.d.sync += self.bus.dat_r.eq(fifo.r_level)
+                with m.Case(REG_IR_OVERFLOW):
+                    m.d.sync += self.bus.dat_r.eq(overflow)
+                    with m.If(self.bus.we):
+                        m.d.sync += overflow.eq(0)
+                with m.Default():
+                    m.d.sync += self.bus.dat_r.eq(0xFFFFFFFF)
+
+        return m
+
+
 if __name__ == "__main__":
     nul = "                                                     "
     pfx = "################        "
@@ -108,7 +168,8 @@ if __name__ == "__main__":
 
     freq_hz = 9e3 # KHz
 
-    dut = NecIrDecoder(freq_hz=freq_hz)
+    # room for only two of the three codes sent
+    dut = NecIrFifo(freq_hz=freq_hz, depth=2)
 
     def bench():
         for ch in rx:
@@ -116,6 +177,33 @@ if __name__ == "__main__":
                 yield
             yield dut.rx.eq(ch == "#")
 
+        def access(addr, data=None):
+            yield dut.bus.adr.eq(addr)
+            yield dut.bus.we.eq(data is not None)
+            yield dut.bus.dat_w.eq(data or 0)
+            yield dut.bus.cyc.eq(1)
+            yield dut.bus.stb.eq(1)
+            yield
+            while not (yield dut.bus.ack):
+                yield
+            yield dut.bus.cyc.eq(0)
+            yield dut.bus.stb.eq(0)
+            yield
+            return (yield dut.bus.dat_r)
+
+        count = yield from access(REG_IR_COUNT)
+        overflow = yield from access(REG_IR_OVERFLOW)
+        codes = []
+        for _ in range(count + 1):
+            codes.append((yield from access(REG_IR_DATA)))
+        yield from access(REG_IR_OVERFLOW, 0)
+        cleared = yield from access(REG_IR_OVERFLOW)
+
+        print(f"count={count} overflow={overflow} cleared={cleared}")
+        print("codes=" + " ".join(f"{code:08x}" for code in codes))
+        assert count == 2 and overflow == 1 and cleared == 0
+        assert codes[0] != codes[1] and codes[2] == 0xFFFFFFFF
+
     sim = Simulator(dut)
     sim.add_clock(1 / freq_hz)
     sim.add_sync_process(bench)
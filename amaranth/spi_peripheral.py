@@ -1,5 +1,6 @@
 from binascii import hexlify
 from amaranth import *
+from amaranth.lib.cdc import FFSynchronizer
 from amaranth.sim import *
 from amaranth.hdl.rec import *
 from debouncer import *
@@ -34,10 +35,21 @@ class SPIInterface(Record):
 
 class SPIPeripheral(Elaboratable):
     """
-    SPI Peripheral with debounced inputs.
+    SPI Peripheral, with the clock edges detected in the sync domain.
+
+    The inputs are either used as they are ("raw"), for when they are
+    conditioned outside, or through a Debouncer of `debounce` samples
+    ("debounce"), which filters glitches but delays the edges by as many
+    cycles, or through two-flop synchronizers ("sync"), which only delay
+    them by two cycles. With "sync", the next bit is also sent as soon as
+    the previous one was sampled, rather than on the updating edge, which
+    leaves a whole SPI clock period to the synchronizers and the controller.
     """
 
-    def __init__(self, *, debounce=8):
+    def __init__(self, *, inputs="raw", debounce=8):
+        assert inputs in ("raw", "debounce", "sync")
+
+        self.inputs = inputs
         self.debounce = debounce
 
         # Record()s are soon to be deprecated by Interface()s
@@ -60,37 +72,53 @@ class SPIPeripheral(Elaboratable):
         shift_count     = Signal(range(8))
         reload_rx       = Signal(1)
         reload_tx       = Signal(1)
+        shift_edge      = Signal(1)
+        clk             = Signal(1)
+        copi            = Signal(1)
+        cs              = Signal(1)
+
+        # condition the inputs
+        for name, i, o in (("clk", self.spi.clk, clk), ("copi", self.spi.copi, copi),
+                           ("cs", self.spi.cs, cs)):
+            if self.inputs == "debounce":
+                m.submodules[f"debounce_{name}"] = debnc = Debouncer(width=self.debounce)
+                m.d.comb += debnc.i.eq(i)
+                m.d.comb += o.eq(debnc.o)
+            elif self.inputs == "sync":
+                m.submodules[f"sync_{name}"] = FFSynchronizer(i, o, stages=2)
+            else:
+                m.d.comb += o.eq(i)
 
         # detect the clock edges
-        m.d.sync += last_clk.eq(self.spi.clk)
-        m.d.sync += last_cs.eq(self.spi.cs)
-        m.d.comb += self.beg.eq(~last_cs & self.spi.cs)
-        m.d.comb += self.end.eq(last_cs & ~self.spi.cs)
-        m.d.comb += sampling_edge.eq(~last_clk & self.spi.clk)
-        m.d.comb += updating_edge.eq(last_clk & ~self.spi.clk)
+        m.d.sync += last_clk.eq(clk)
+        m.d.sync += last_cs.eq(cs)
+        m.d.comb += self.beg.eq(~last_cs & cs)
+        m.d.comb += self.end.eq(last_cs & ~cs)
+        m.d.comb += sampling_edge.eq(~last_clk & clk)
+        m.d.comb += updating_edge.eq(last_clk & ~clk)
+        m.d.comb += shift_edge.eq(sampling_edge if self.inputs == "sync" else updating_edge)
 
         # bind shift registers to the I/O ports
         m.d.comb += self.spi.cipo.eq(shift_cipo[-1])
 
         self.tx.ready.reset = 1
 
-        # exchange data with the internal module
-        with m.If(self.tx.ready & self.tx.valid):
-            m.d.sync += next_cipo.eq(self.tx.data)
-            m.d.sync += self.tx.ready.eq(0)
+        # acknowledge the data received by the internal module
         with m.If(self.rx.ready & self.rx.valid):
             m.d.sync += self.rx.valid.eq(0)
 
         # shift data in and out on clock edges
         m.d.sync += reload_rx.eq(0)
-        m.d.sync += reload_tx.eq(0)
-        with m.If(self.spi.cs):
-            with m.If(updating_edge):
+        with m.If(cs):
+            with m.If(shift_edge):
                 m.d.sync += shift_cipo.eq(Cat(0, shift_cipo))
-                with m.If(shift_count == 0):
-                    m.d.sync += reload_tx.eq(1)
+                # on the sampling edge, the count is not incremented yet; the
+                # reload happens in the same cycle, for the first bit to go out
+                # as early as the others
+                with m.If(shift_count == (7 if self.inputs == "sync" else 0)):
+                    m.d.comb += reload_tx.eq(1)
             with m.If(sampling_edge):
-                m.d.sync += shift_copi.eq(Cat(self.spi.copi, shift_copi[0:7]))
+                m.d.sync += shift_copi.eq(Cat(copi, shift_copi[0:7]))
                 m.d.sync += shift_count.eq(shift_count + 1)
                 with m.If(shift_count == 7):
                     m.d.sync += reload_rx.eq(1)
@@ -106,55 +134,94 @@ class SPIPeripheral(Elaboratable):
             m.d.sync += shift_cipo.eq(next_cipo)
             m.d.sync += next_cipo.eq(0xFF)
 
+        # take data from the internal module, after the reload, so that a byte
+        # given right as the shift register is reloaded is kept for the next one
+        with m.If(self.tx.ready & self.tx.valid):
+            m.d.sync += next_cipo.eq(self.tx.data)
+            m.d.sync += self.tx.ready.eq(0)
+
         return m
 
 
 if __name__ == "__main__":
-    dut = SPIPeripheral()
-
     clk_freq_hz = 10e6 # MHz
-    spi_freq_hz = 2e6  # MHz
 
     copi = "_____ ##__##__##__##__##__##__##__##__########________####____####__________"
     clk  = "_______#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#______"
     cs   = "_____##################################################################_____"
-    cipo = ""
-    rx_data = bytearray()
     tx_data = b"\xFE\x55\x01\x8F\x00\x00\x00\x00"
 
-    def bench():
-        global cipo
-        global rx_data
-        global tx_data
+    def run(inputs, cycles, vcd_file=None):
+        """Send the pattern with `cycles` per character, return cipo and rx data."""
+        dut = SPIPeripheral(inputs=inputs)
+        cipo = ""
+        rx_data = bytearray()
 
-        n = 0
+        def bench():
+            nonlocal cipo
 
-        yield dut.rx.ready.eq(1)
+            n = 0
 
-        for i in range(len(clk)):
-            for _ in range(int(clk_freq_hz / spi_freq_hz)):
-                yield
+            yield dut.rx.ready.eq(1)
+
+            for i in range(len(clk)):
+                for _ in range(cycles):
+                    yield
+
+                    yield dut.tx.data.eq(tx_data[n])
+                    yield dut.tx.valid.eq(1)
+                    if (yield dut.tx.ready) == 1:
+                        n += 1
+                    if (yield dut.rx.valid) == 1:
+                        rx_data.append((yield dut.rx.data))
+
+                cipo += "#" if (yield dut.spi.cipo) else "_"
 
-                yield dut.tx.data.eq(tx_data[n])
-                yield dut.tx.valid.eq(1)
-                if (yield dut.tx.ready) == 1:
-                    n += 1
+                yield dut.spi.copi.eq(copi[i] == "#")
+                yield dut.spi.clk.eq(clk[i] == "#")
+                yield dut.spi.cs.eq(cs[i] == "#")
+
+            # let the debouncers see the end of the transfer
+            for _ in range(2 * 8):
+                yield
                 if (yield dut.rx.valid) == 1:
                     rx_data.append((yield dut.rx.data))
 
-            cipo += "#" if (yield dut.spi.cipo) else "_"
+        sim = Simulator(dut)
+        sim.add_clock(1 / clk_freq_hz)
+        sim.add_sync_process(bench)
+        if vcd_file is None:
+            sim.run()
+        else:
+            with sim.write_vcd(vcd_file=vcd_file):
+                sim.run()
+        return cipo, rx_data
 
-            yield dut.spi.copi.eq(copi[i] == "#")
-            yield dut.spi.clk.eq(clk[i] == "#")
-            yield dut.spi.cs.eq(cs[i] == "#")
-
-    sim = Simulator(dut)
-    sim.add_clock(1 / clk_freq_hz)
-    sim.add_sync_process(bench)
-    with sim.write_vcd(vcd_file=f"{__file__[:-3]}.vcd"):
-        sim.run()
+    cipo, rx_data = run("raw", 5, vcd_file=f"{__file__[:-3]}.vcd")
 
     print(f"cipo={cipo}")
     print(f"copi={rx_data}")
 
     assert rx_data == b"\xAA\xAA\xF0\xCC"
+
+    # bits sent by the peripheral, sampled on the rising edges of the clock
+    def sampled(cipo):
+        return "".join(cipo[i] for i in range(1, len(clk)) if clk[i - 1:i + 1] == "_#")
+
+    # highest SPI clock still receiving the pattern, and sending the same
+    # bits as at the lowest one, for each input mode
+    print(f"{'inputs':>8} {'cycles':>6} {'spi_hz':>10}  ok")
+    for inputs in ("raw", "debounce", "sync"):
+        expected = None
+        highest = None
+        for cycles in (24, 16, 12, 10, 8, 6, 5, 4, 3, 2, 1):
+            cipo, rx_data = run(inputs, cycles)
+            if expected is None:
+                expected = sampled(cipo)
+            ok = rx_data == b"\xAA\xAA\xF0\xCC" and sampled(cipo) == expected
+            spi_freq_hz = clk_freq_hz / (2 * cycles)
+            print(f"{inputs:>8} {cycles:6} {spi_freq_hz:10.0f}  {ok}")
+            if ok and (highest is None or spi_freq_hz > highest):
+                highest = spi_freq_hz
+        print(f"{inputs:>8} highest SPI clock passing: {highest:.0f} Hz"
+              f" ({clk_freq_hz / highest:.0f} cycles per SPI clock)")
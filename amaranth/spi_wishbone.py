@@ -0,0 +1,299 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.rec import *
+from spi_peripheral import *
+
+
+__all__ = [ "WishboneInterface", "SPIWishboneController" ]
+
+
+# frame commands and acknowledgement, as for the Wishbone-Serial bridge
+CMD_WRITE   = 0x00
+CMD_READ    = 0x01
+ACK         = 0x00
+
+# Wishbone B4 cycle type identifiers of the burst cycles
+CTI_CONSTANT    = 0b001
+CTI_INCREMENT   = 0b010
+CTI_END         = 0b111
+
+
+class WishboneInterface(Record):
+    def __init__(self, *, addr_width, data_width=32):
+        super().__init__([
+            ("adr",     addr_width,         DIR_FANOUT),
+            ("dat_w",   data_width,         DIR_FANOUT),
+            ("dat_r",   data_width,         DIR_FANIN),
+            ("sel",     data_width // 8,    DIR_FANOUT),
+            ("cyc",     1,                  DIR_FANOUT),
+            ("stb",     1,                  DIR_FANOUT),
+            ("we",      1,                  DIR_FANOUT),
+            ("ack",     1,                  DIR_FANIN),
+            ("cti",     3,                  DIR_FANOUT),
+            ("bte",     2,                  DIR_FANOUT),
+        ])
+
+
+class SPIWishboneController(Elaboratable):
+    """
+    Wishbone controller driven by Wishbone-SPI frames from an SPIPeripheral.
+
+    The frames are the ones of the Wishbone-Serial bridge: a command byte,
+    a length in bytes, and a big-endian word address whose bit 31 selects
+    the same register for every word (FIFO) instead of incrementing ones.
+
+        Write: 00 | LL | AA | AA | AA | AA | VV | VV | VV | VV | ... (LL bytes)
+        Read:  FF | FF | ... | 00                   (ACK once all are written)
+
+        Write: 01 | LL | AA | AA | AA | AA | FF | FF | ...
+        Read:  FF | FF | ... | 00 | VV | VV | VV | VV | ... (LL bytes)
+
+    The controller clocks 0xFF while the peripheral is busy, and the ACK
+    tells when the data starts. The words of a frame are accessed with a
+    single burst cycle: each word written is sent on the bus while the next
+    is received, and each word read is fetched while the previous is sent,
+    so the words follow each other with no turnaround as long as the bus
+    acknowledges an access within the 4 bytes of a word.
+
+    Bytes other than a command, such as the padding clocked at the end of
+    a reply, are skipped, and a frame starts over at every chip select.
+    `inputs` selects how the SPIPeripheral conditions the SPI signals.
+    """
+
+    def __init__(self, *, addr_width=29, inputs="raw"):
+        self.spiperi = SPIPeripheral(inputs=inputs)
+        self.spi = self.spiperi.spi
+        self.bus = WishboneInterface(addr_width=addr_width)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.spiperi = spiperi = self.spiperi
+        rx = spiperi.rx
+        tx = spiperi.tx
+        bus = self.bus
+
+        cmd             = Signal(8)
+        addr            = Signal(32)
+        fixed           = Signal(1)
+        byte_num        = Signal(range(4))
+        word            = Signal(32)
+        spi_words       = Signal(6)
+        bus_words       = Signal(6)
+        tx_bytes        = Signal(range(4 + 1))
+        rdata           = Signal(32)
+        rdata_valid     = Signal(1)
+        reading         = Signal(1)
+
+        m.d.comb += rx.ready.eq(1)
+        m.d.comb += bus.sel.eq(0b1111)
+        m.d.comb += bus.cti.eq(Mux(bus_words == 1, CTI_END,
+                                   Mux(fixed, CTI_CONSTANT, CTI_INCREMENT)))
+
+        # end of each bus access: the burst ends with the last word
+        with m.If(bus.stb & bus.ack):
+            m.d.sync += bus.stb.eq(0)
+            m.d.sync += bus.adr.eq(bus.adr + ~fixed)
+            m.d.sync += bus_words.eq(bus_words - 1)
+            with m.If(bus_words == 1):
+                m.d.sync += bus.cyc.eq(0)
+            with m.If(~bus.we):
+                m.d.sync += rdata.eq(bus.dat_r)
+                m.d.sync += rdata_valid.eq(1)
+
+        # fetch the next word as soon as the previous one is being sent
+        with m.If(reading & ~bus.stb & ~rdata_valid & (bus_words != 0)):
+            m.d.sync += bus.we.eq(0)
+            m.d.sync += bus.stb.eq(1)
+            m.d.sync += bus.cyc.eq(1)
+
+        def restart():
+            # a new chip select starts a new frame, whatever the state
+            with m.If(spiperi.beg):
+                m.next = "CMD"
+
+        with m.FSM(domain="sync") as fsm:
+            m.d.comb += reading.eq(fsm.ongoing("READ") | fsm.ongoing("SEND"))
+
+            with m.State("CMD"):
+                with m.If(rx.valid & ((rx.data == CMD_READ) | (rx.data == CMD_WRITE))):
+                    m.d.sync += cmd.eq(rx.data)
+                    m.next = "LENGTH"
+
+            with m.State("LENGTH"):
+                with m.If(rx.valid):
+                    m.d.sync += spi_words.eq(rx.data[2:])
+                    m.d.sync += bus_words.eq(rx.data[2:])
+                    m.d.sync += byte_num.eq(0)
+                    m.next = "ADDRESS"
+                restart()
+
+            with m.State("ADDRESS"):
+                with m.If(rx.valid):
+                    m.d.sync += addr.eq(Cat(rx.data, addr[:24]))
+                    m.d.sync += byte_num.eq(byte_num + 1)
+                    with m.If(byte_num == 3):
+                        m.d.sync += bus.adr.eq(Cat(rx.data, addr[:24]))
+                        m.d.sync += fixed.eq(addr[23])
+                        m.d.sync += rdata_valid.eq(0)
+                        with m.If(cmd == CMD_WRITE):
+                            m.next = "WRITE"
+                        with m.Else():
+                            m.next = "READ"
+                restart()
+
+            with m.State("WRITE"):
+                with m.If(spi_words == 0):
+                    with m.If(~bus.cyc):
+                        m.next = "ACK"
+                with m.Elif(rx.valid):
+                    m.d.sync += word.eq(Cat(rx.data, word[:24]))
+                    m.d.sync += byte_num.eq(byte_num + 1)
+                    with m.If(byte_num == 3):
+                        m.d.sync += bus.dat_w.eq(Cat(rx.data, word[:24]))
+                        m.d.sync += bus.we.eq(1)
+                        m.d.sync += bus.stb.eq(1)
+                        m.d.sync += bus.cyc.eq(1)
+                        m.d.sync += spi_words.eq(spi_words - 1)
+                restart()
+
+            with m.State("ACK"):
+                m.d.comb += tx.data.eq(ACK)
+                m.d.comb += tx.valid.eq(1)
+                with m.If(tx.ready):
+                    m.next = "CMD"
+                restart()
+
+            with m.State("READ"):
+                # the ACK waits for the first word, the others follow it
+                with m.If(rdata_valid | (spi_words == 0)):
+                    m.d.comb += tx.data.eq(ACK)
+                    m.d.comb += tx.valid.eq(1)
+                    with m.If(tx.ready):
+                        m.d.sync += tx_bytes.eq(0)
+                        m.next = "SEND"
+                restart()
+
+            with m.State("SEND"):
+                with m.If(tx_bytes != 0):
+                    m.d.comb += tx.data.eq(word[24:])
+                    m.d.comb += tx.valid.eq(1)
+                    with m.If(tx.ready):
+                        m.d.sync += word.eq(word << 8)
+                        m.d.sync += tx_bytes.eq(tx_bytes - 1)
+                with m.Elif(spi_words == 0):
+                    m.next = "CMD"
+                with m.Elif(rdata_valid):
+                    m.d.sync += word.eq(rdata)
+                    m.d.sync += rdata_valid.eq(0)
+                    m.d.sync += tx_bytes.eq(4)
+                    m.d.sync += spi_words.eq(spi_words - 1)
+                restart()
+
+        # a burst interrupted by the chip select ends with its current access
+        with m.If(spiperi.beg & ~bus.stb):
+            m.d.sync += bus.cyc.eq(0)
+
+        return m
+
+
+if __name__ == "__main__":
+    clk_freq_hz = 48e6 # MHz
+    words = 21
+
+    dut = SPIWishboneController(inputs="sync")
+
+    # registers behind the bus, acknowledged one cycle after the request,
+    # with a counter incremented on every read at the last address (FIFO)
+    m = Module()
+    m.submodules.dut = dut
+    regs = Array(Signal(32, name=f"reg{i}") for i in range(64))
+    counter = Signal(32)
+    cycles = Signal(32)
+    m.d.sync += cycles.eq(cycles + 1)
+    m.d.sync += dut.bus.ack.eq(0)
+    with m.If(dut.bus.cyc & dut.bus.stb & ~dut.bus.ack):
+        m.d.sync += dut.bus.ack.eq(1)
+        with m.If(dut.bus.we):
+            m.d.sync += regs[dut.bus.adr[:6]].eq(dut.bus.dat_w)
+        with m.Elif(dut.bus.adr[:6] == 63):
+            m.d.sync += dut.bus.dat_r.eq(counter)
+            m.d.sync += counter.eq(counter + 1)
+        with m.Else():
+            m.d.sync += dut.bus.dat_r.eq(regs[dut.bus.adr[:6]])
+
+    results = []
+
+    def bench():
+        def xfer(data, half):
+            rx = bytearray()
+            for byte in data:
+                value = 0
+                for bit in range(8):
+                    yield dut.spi.copi.eq(byte >> (7 - bit) & 1)
+                    for _ in range(half):
+                        yield
+                    yield dut.spi.clk.eq(1)
+                    value = value << 1 | (yield dut.spi.cipo)
+                    for _ in range(half):
+                        yield
+                    yield dut.spi.clk.eq(0)
+                rx.append(value)
+            return rx
+
+        def wait_ack(half):
+            for _ in range(16):
+                if (yield from xfer(b"\xFF", half)) == bytes([ACK]):
+                    return True
+            return False
+
+        for div in (64, 32, 16, 8, 6, 4, 2):
+            half = div // 2
+            values = [(0x01010101 * div + i * 0x1234567) & 0xFFFFFFFF for i in range(words)]
+            data = b"".join(v.to_bytes(4, "big") for v in values)
+            ok = True
+
+            yield dut.spi.cs.eq(1)
+            for _ in range(half):
+                yield
+
+            start = yield cycles
+            yield from xfer(bytes([CMD_WRITE, words * 4, 0, 0, 0, 0]) + data, half)
+            ok &= yield from wait_ack(half)
+            write_time = ((yield cycles) - start) / clk_freq_hz
+
+            start = yield cycles
+            yield from xfer(bytes([CMD_READ, words * 4, 0, 0, 0, 0]), half)
+            ok &= yield from wait_ack(half)
+            ok &= (yield from xfer(b"\xFF" * words * 4, half)) == data
+            read_time = ((yield cycles) - start) / clk_freq_hz
+
+            # fixed-address burst: the same register read every time
+            counter_start = yield counter
+            yield from xfer(bytes([CMD_READ, 4 * 4, 0x80, 0, 0, 63]), half)
+            ok &= yield from wait_ack(half)
+            ok &= (yield from xfer(b"\xFF" * 4 * 4, half)) == b"".join(
+                (counter_start + i).to_bytes(4, "big") for i in range(4))
+
+            yield dut.spi.cs.eq(0)
+            for _ in range(half * 4):
+                yield
+
+            results.append((clk_freq_hz / div, write_time, read_time, ok))
+
+    sim = Simulator(m)
+    sim.add_clock(1 / clk_freq_hz)
+    sim.add_sync_process(bench)
+    with sim.write_vcd(vcd_file=f"{__file__[:-3]}.vcd"):
+        sim.run()
+
+    print(f"{'spi_hz':>12} {'write words/s':>14} {'read words/s':>14} {'link words/s':>14}  ok")
+    for spi_freq_hz, write_time, read_time, ok in results:
+        print(f"{spi_freq_hz:12.0f} {words / write_time:14.0f} {words / read_time:14.0f}"
+              f" {spi_freq_hz / 32:14.0f}  {ok}")
+
+    passing = [spi_freq_hz for spi_freq_hz, *_, ok in results if ok]
+    print(f"highest SPI clock passing: {max(passing):.0f} Hz")
+
+    # the edges of the SPI clock are detected in the system clock domain,
+    # through the synchronizers, which needs two cycles per half period
+    assert all(ok for spi_freq_hz, *_, ok in results if spi_freq_hz <= clk_freq_hz / 4)
@@ -14,9 +14,14 @@ from pico_ice import *
 from pmod_7seg import *
 from nec_ir_decoder import *
 from spi_peripheral import *
+from spi_wishbone import *
 from debouncer import *
 
 
+# base word address of the registers of the IR FIFO on the bus
+IR_BASE = 0x2000
+
+
 class TopLevel(Elaboratable):
     """
     Top module to test each Pmod with real hardware.
@@ -36,9 +41,10 @@ class TopLevel(Elaboratable):
         m.submodules.debnc = debnc = Debouncer(width=32)
         m.d.comb += debnc.i.eq(irsensor.rx)
 
-        # IR decoder fed into the 7-segment and SPI interface
-        m.submodules.irdec = irdec = NecIrDecoder(freq_hz=freq_hz)
-        m.d.comb += irdec.rx.eq(debnc.o)
+        # IR decoder fed into the 7-segment and, through a FIFO, to the bus
+        m.submodules.irfifo = irfifo = NecIrFifo(freq_hz=freq_hz)
+        m.d.comb += irfifo.rx.eq(debnc.o)
+        irdec = irfifo.irdec
 
         # 7-segment display there for debugging
         m.submodules.p7seg = p7seg = Pmod7Seg()
@@ -46,27 +52,30 @@ class TopLevel(Elaboratable):
         m.d.comb += pmod_7seg.seg.eq(p7seg.seg)
         m.d.comb += p7seg.byte.eq(irbyte)
 
-        m.submodules.spi_cs = spi_cs = Debouncer(width=8)
-        m.d.comb += spi_cs.i.eq(spi.cs)
-        m.submodules.spi_clk = spi_clk = Debouncer(width=8)
-        m.d.comb += spi_clk.i.eq(spi.clk)
-        m.submodules.spi_copi = spi_copi = Debouncer(width=8)
-        m.d.comb += spi_copi.i.eq(spi.copi)
-
-        # SPI peripheral bridge for querying the IR data
-        m.submodules.spiperi = spiperi = SPIPeripheral()
+        # SPI to Wishbone bridge for querying the IR data, with the SPI inputs
+        # through two-flop synchronizers rather than debouncers, for a faster clock
+        m.submodules.wbctrl = wbctrl = SPIWishboneController(inputs="sync")
         m.d.comb += spi.cipo.oe.eq(1)
-        m.d.comb += spi.cipo.o.eq(spiperi.spi.cipo)
-        m.d.comb += spiperi.spi.copi.eq(spi_copi.o)
-        m.d.comb += spiperi.spi.clk.eq(spi_clk.o)
-        m.d.comb += spiperi.spi.cs.eq(spi_cs.o)
-
-        # hookup the SPI peripheral to the IR sensor
-        with m.If(spiperi.tx.ready):
-            m.d.sync += spiperi.tx.valid.eq(0)
+        m.d.comb += spi.cipo.o.eq(wbctrl.spi.cipo)
+        m.d.comb += wbctrl.spi.copi.eq(spi.copi)
+        m.d.comb += wbctrl.spi.clk.eq(spi.clk)
+        m.d.comb += wbctrl.spi.cs.eq(spi.cs)
+
+        # address decoding: the IR FIFO, or 0xFFFFFFFF everywhere else
+        bus = wbctrl.bus
+        ir_sel = Signal(1)
+        other_ack = Signal(1)
+        m.d.comb += ir_sel.eq(bus.adr[2:] == IR_BASE >> 2)
+        m.d.comb += irfifo.bus.adr.eq(bus.adr[:2])
+        m.d.comb += irfifo.bus.dat_w.eq(bus.dat_w)
+        m.d.comb += irfifo.bus.we.eq(bus.we)
+        m.d.comb += irfifo.bus.stb.eq(bus.stb)
+        m.d.comb += irfifo.bus.cyc.eq(bus.cyc & ir_sel)
+        m.d.sync += other_ack.eq(bus.cyc & bus.stb & ~ir_sel & ~other_ack)
+        m.d.comb += bus.ack.eq(irfifo.bus.ack | other_ack)
+        m.d.comb += bus.dat_r.eq(Mux(other_ack, 0xFFFFFFFF, irfifo.bus.dat_r))
+
         with m.If(irdec.valid):
-            m.d.sync += spiperi.tx.valid.eq(1)
-            m.d.sync += spiperi.tx.data.eq(irdec.data[8:])
             m.d.sync += irbyte.eq(irdec.data[8:])
 
         # visual feedback of IR remote action with an LED
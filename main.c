@@ -21,8 +21,26 @@
 
 #include "font.h"
 
+// register map, keep in sync with ros2/src/pico_ice/pico_ice/registers.py
+#define REG_IMU_X 0x1000
+#define REG_IMU_Y 0x1001
+#define REG_IMU_Z 0x1002
+
+// address flag to access the same register for every word of a frame (FIFO)
+#define ADDR_FIFO 0x80000000
+
+// address flags of a write of two words modifying the register in a single
+// operation: (mask, value) replaces the bits set in mask, (expected, value)
+// writes value only if the register holds expected; a read at ADDR_RESULT
+// returns the new value, or the one found by the compare-and-swap
+#define ADDR_MASKED 0x20000000
+#define ADDR_CAS 0x40000000
+#define ADDR_RESULT (ADDR_MASKED | ADDR_CAS)
+
 uint8_t framebuffer[64][96][2];
 
+uint32_t g_rmw_result = 0xFFFFFFFF;
+
 uint32_t g_imu_x = 0;
 uint32_t g_imu_y = 0;
 uint32_t g_imu_z = 0;
@@ -46,8 +64,56 @@ void draw_text(uint16_t x, uint16_t y, char *s) {
     }
 }
 
+uint32_t reg_read(uint32_t addr) {
+    switch (addr) {
+    case REG_IMU_X:
+        return g_imu_x;
+    case REG_IMU_Y:
+        return g_imu_y;
+    case REG_IMU_Z:
+        return g_imu_z;
+    }
+    return 0xFFFFFFFF;
+}
+
+void reg_write(uint32_t addr, uint32_t u32) {
+    switch (addr) {
+    case REG_IMU_X:
+        g_imu_x = u32;
+        break;
+    case REG_IMU_Y:
+        g_imu_y = u32;
+        break;
+    case REG_IMU_Z:
+        g_imu_z = u32;
+        break;
+    }
+}
+
 void ice_wishbone_serial_read_cb(uint32_t addr, uint8_t *data, size_t size) {
     printf("read addr=0x%08lx size=x%d\r\n", addr, size);
+
+    if ((addr & ADDR_RESULT) == ADDR_RESULT) {
+        for (size_t i = 0; i + 4 <= size; i += 4) {
+            data[i + 0] = g_rmw_result >> 24;
+            data[i + 1] = g_rmw_result >> 16;
+            data[i + 2] = g_rmw_result >> 8;
+            data[i + 3] = g_rmw_result >> 0;
+        }
+        return;
+    }
+
+    // burst access: one 32-bit register per 4 bytes, at incrementing addresses,
+    // or all at the same address to drain or fill a FIFO
+    uint32_t step = (addr & ADDR_FIFO) ? 0 : 1;
+    addr &= ~ADDR_FIFO;
+    for (size_t i = 0; i + 4 <= size; i += 4, addr += step) {
+        uint32_t u32 = reg_read(addr);
+        data[i + 0] = u32 >> 24;
+        data[i + 1] = u32 >> 16;
+        data[i + 2] = u32 >> 8;
+        data[i + 3] = u32 >> 0;
+    }
 }
 
 void draw_label_value(uint16_t x, uint16_t y, char *label, uint32_t value) {
@@ -58,25 +124,43 @@ void draw_label_value(uint16_t x, uint16_t y, char *label, uint32_t value) {
 }
 
 void ice_wishbone_serial_write_cb(uint32_t addr, const uint8_t *data, size_t size) {
+    // a write of 0 bytes is a NOP, used by the host to resynchronize
+    if (size == 0) {
+        return;
+    }
+
     printf("write addr=0x%08lx size=x%d data=0x", addr, size);
     for (size_t i = 0; i < size; i++) {
         printf("%02X", data[i]);
     }
     printf("\r\n");
 
-    uint32_t u32 = data[0] << 24 | data[1] << 16 | data[2] << 8 | data[3] << 0;
     uint16_t y = 0;
 
-    switch (addr) {
-    case 0x1000:
-        g_imu_x = u32;
-        break;
-    case 0x1001:
-        g_imu_y = u32;
-        break;
-    case 0x1002:
-        g_imu_z = u32;
-        break;
+    if ((addr & ADDR_RESULT) && size == 8) {
+        // read-modify-write, done here so that nothing can come in-between
+        uint32_t a = data[0] << 24 | data[1] << 16 | data[2] << 8 | data[3] << 0;
+        uint32_t b = data[4] << 24 | data[5] << 16 | data[6] << 8 | data[7] << 0;
+        uint32_t reg = addr & ~(ADDR_RESULT | ADDR_FIFO);
+        uint32_t old = reg_read(reg);
+
+        if ((addr & ADDR_RESULT) == ADDR_MASKED) {
+            g_rmw_result = (old & ~a) | (b & a);
+            reg_write(reg, g_rmw_result);
+        } else if ((addr & ADDR_RESULT) == ADDR_CAS) {
+            g_rmw_result = old;
+            if (old == a) {
+                reg_write(reg, b);
+            }
+        }
+    } else {
+        // burst access: one 32-bit register per 4 bytes, at incrementing addresses,
+        // or all at the same address to drain or fill a FIFO
+        uint32_t step = (addr & ADDR_FIFO) ? 0 : 1;
+        addr &= ~ADDR_FIFO;
+        for (size_t i = 0; i + 4 <= size; i += 4, addr += step) {
+            reg_write(addr, data[i + 0] << 24 | data[i + 1] << 16 | data[i + 2] << 8 | data[i + 3] << 0);
+        }
     }
 
     draw_text(0, y, "ROS input"); y += 18;
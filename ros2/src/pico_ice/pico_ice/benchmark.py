@@ -0,0 +1,249 @@
+import argparse
+from array import array
+import select
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.trace import TraceWriter
+from pico_ice.wishbone_serial import (
+    check_acks, encode_read, encode_write, from_wire, WishboneBus)
+
+
+ADDR = 0x1000
+
+
+def single_read(bus, words):
+    for i in range(words):
+        bus.read(ADDR + i)
+
+
+def single_write(bus, words):
+    for i in range(words):
+        bus.write(ADDR + i, i)
+
+
+def burst_read(bus, words):
+    bus.read_block(ADDR, words)
+
+
+def burst_write(bus, words):
+    bus.write_block(ADDR, range(words))
+
+
+def batch_read(bus, words):
+    with bus.batch() as b:
+        for i in range(words):
+            b.read(ADDR + i)
+
+
+def batch_write(bus, words):
+    with bus.batch() as b:
+        for i in range(words):
+            b.write(ADDR + i, i)
+
+
+PATTERNS = {
+    'single_read': single_read,
+    'single_write': single_write,
+    'burst_read': burst_read,
+    'burst_write': burst_write,
+    'batch_read': batch_read,
+    'batch_write': batch_write,
+}
+
+
+def run(bus, pattern, *, words, count):
+    """
+    Access `words` registers `count` times with the given pattern.
+
+    Return a dict with the throughput and the latency percentiles of the
+    accesses, each access covering all of the `words` registers.
+    """
+    fn = PATTERNS[pattern]
+    fn(bus, words)
+
+    samples = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t0 = time.perf_counter()
+        fn(bus, words)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+
+    centiles = statistics.quantiles(samples, n=100)
+    return {
+        'pattern': pattern,
+        'words': words,
+        'ops_per_s': count / elapsed,
+        'words_per_s': count * words / elapsed,
+        'p50_ms': centiles[49] * 1e3,
+        'p99_ms': centiles[98] * 1e3,
+    }
+
+
+def pyserial_read(bus, addr):
+    """Single read as done before the in-place path: through pyserial."""
+    frames = bytearray()
+    size = encode_read(frames, addr, 1)
+    bus.serial.write(frames)
+    words = array('I')
+    words.frombytes(bus.serial.read(size))
+    return from_wire(words)[0]
+
+
+def pyserial_write(bus, addr, data):
+    """Single write as done before the in-place path: through pyserial."""
+    frames = bytearray()
+    size = encode_write(frames, addr, (data,))
+    bus.serial.write(frames)
+    check_acks(bus.serial.read(size))
+
+
+MICRO = {
+    'pyserial_read': lambda bus: pyserial_read(bus, ADDR),
+    'pyserial_write': lambda bus: pyserial_write(bus, ADDR, 1),
+    'inplace_read': lambda bus: bus.read(ADDR),
+    'inplace_write': lambda bus: bus.write(ADDR, 1),
+}
+
+
+def _syscalls():
+    """Return the number of read and write syscalls of this thread (Linux only)."""
+    counts = {}
+    with open('/proc/thread-self/io') as f:
+        for line in f:
+            key, value = line.split(':')
+            counts[key] = int(value)
+    return counts['syscr'] + counts['syscw']
+
+
+def micro(bus, path, *, count):
+    """
+    Measure the cost of one single-register access with the given path.
+
+    Return a dict with the time, the read/write and select syscalls, and
+    the bytes transiently allocated per access.
+    """
+    fn = MICRO[path]
+    fn(bus)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        fn(bus)
+    elapsed = time.perf_counter() - start
+
+    selects = 0
+    select_select = select.select
+
+    def counting_select(*args):
+        nonlocal selects
+        selects += 1
+        return select_select(*args)
+
+    overhead = -_syscalls() + _syscalls()
+    select.select = counting_select
+    try:
+        before = _syscalls()
+        for _ in range(count):
+            fn(bus)
+        syscalls = _syscalls() - before - overhead
+    finally:
+        select.select = select_select
+
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            fn(bus)
+            allocated += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'path': path,
+        'us_per_op': elapsed / count * 1e6,
+        'syscalls_per_op': syscalls / count,
+        'selects_per_op': selects / count,
+        'bytes_per_op': allocated / count,
+    }
+
+
+def report_micro(results):
+    print(f"{'path':<16} {'us/op':>8} {'rw syscalls':>12} {'selects':>8} {'bytes':>8}")
+    for r in results:
+        print(f"{r['path']:<16} {r['us_per_op']:>8.1f} {r['syscalls_per_op']:>12.2f}"
+              f" {r['selects_per_op']:>8.2f} {r['bytes_per_op']:>8.1f}")
+
+
+def report(results):
+    print(f"{'pattern':<14} {'words':>5} {'ops/s':>10} {'words/s':>10}"
+          f" {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['pattern']:<14} {r['words']:>5} {r['ops_per_s']:>10.1f}"
+              f" {r['words_per_s']:>10.1f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='measure throughput and latency of the wishbone bridge')
+    parser.add_argument('--serial', dest='serial', default=None,
+                        help='serial port of a bridge, or run against an emulator if absent')
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='round trip delay of the emulator, in seconds')
+    parser.add_argument('--frame-latency', type=float, default=0.00002,
+                        help='per-frame execution delay of the emulator, in seconds')
+    parser.add_argument('--words', type=int, nargs='+', default=[1, 16, 64],
+                        help='number of registers covered by each access')
+    parser.add_argument('--count', type=int, default=100,
+                        help='number of accesses to measure per pattern, at least 2')
+    parser.add_argument('--pattern', choices=PATTERNS, nargs='+', default=list(PATTERNS),
+                        help='access patterns to measure')
+    parser.add_argument('--micro', action='store_true',
+                        help='compare the cost of single accesses through pyserial and in place')
+    parser.add_argument('--trace', default=None,
+                        help='record the bytes on the wire to this file, see pico_ice.trace')
+    args = parser.parse_args()
+    if args.count < 2:
+        # the latency percentiles need at least 2 samples
+        parser.error('--count must be at least 2')
+
+    emu = None
+    proc = None
+    port = args.serial
+    if port is None and args.micro:
+        # in another process, to keep the allocations of the emulator out of the count
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'pico_ice.emulator', '--latency', str(args.latency),
+             '--frame-latency', str(args.frame_latency)], stdout=subprocess.PIPE, text=True)
+        port = proc.stdout.readline().strip()
+    elif port is None:
+        emu = BridgeEmulator(latency=args.latency, frame_latency=args.frame_latency)
+        port = emu.port
+    trace = None if args.trace is None else TraceWriter(args.trace)
+
+    try:
+        with WishboneBus(port) as bus:
+            bus.trace = trace
+            if args.micro:
+                report_micro([micro(bus, path, count=args.count) for path in MICRO])
+            else:
+                report([run(bus, pattern, words=words, count=args.count)
+                        for pattern in args.pattern for words in args.words])
+    finally:
+        if trace is not None:
+            trace.close()
+        if emu is not None:
+            emu.close()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+from array import array
+import threading
+import time
+
+from pico_ice.wishbone_serial import from_wire, MERGE_GAP, plan_bursts
+
+
+class NoCache:
+    """Always access the hardware: the default for volatile registers."""
+
+    fill_on_read = False
+    fill_on_write = False
+
+    def fresh(self, age):
+        return False
+
+
+class Static:
+    """Read the register once, then serve it locally: IDs, versions..."""
+
+    fill_on_read = True
+    fill_on_write = True
+
+    def fresh(self, age):
+        return True
+
+
+class TTL:
+    """Serve the register locally for `ttl` seconds after reading it."""
+
+    fill_on_read = True
+    fill_on_write = True
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def fresh(self, age):
+        return age < self.ttl
+
+
+class WriteThrough:
+    """
+    Keep a local copy of what was written, for registers only the host writes.
+
+    Writes go to the hardware as well, and reads are served from the local
+    copy once the register was written, or from the hardware before that.
+    """
+
+    fill_on_read = False
+    fill_on_write = True
+
+    def fresh(self, age):
+        return True
+
+
+class RegisterCache:
+    """
+    Cache in front of a WishboneBus, with a policy per range of addresses.
+
+    It provides the same read/write methods as the bus, but serves the reads
+    locally as permitted by the policy of each register, and counts the
+    `hits` and `misses`. The misses of a read_block() are fetched from the
+    bus in a single batch.
+
+        cache = RegisterCache(bus)
+        cache.set_policy(0x0000, Static(), n=4)
+        cache.set_policy(0x1000, WriteThrough(), n=3)
+    """
+
+    def __init__(self, bus, default=NoCache()):
+        self.bus = bus
+        self.default = default
+        self.lock = threading.Lock()
+        self.ranges = []
+        self.policies = {}
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_policy(self, addr, policy, n=1):
+        """Apply `policy` to the `n` registers starting at `addr`."""
+        with self.lock:
+            self.ranges.append((addr, addr + n, policy))
+            self.policies.clear()
+            self._invalidate(addr, n)
+
+    def policy(self, addr):
+        """Return the policy of the register at `addr`, the last set winning."""
+        policy = self.policies.get(addr)
+        if policy is None:
+            policy = self.default
+            for start, end, p in reversed(self.ranges):
+                if start <= addr < end:
+                    policy = p
+                    break
+            self.policies[addr] = policy
+        return policy
+
+    def invalidate(self, addr=None, n=1):
+        """Drop the local copy of `n` registers at `addr`, or of all of them."""
+        with self.lock:
+            self._invalidate(addr, n)
+
+    def _invalidate(self, addr, n):
+        if addr is None:
+            self.values.clear()
+            return
+        for i in range(n):
+            self.values.pop(addr + i, None)
+
+    def _lookup(self, addr, now):
+        entry = self.values.get(addr)
+        if entry is not None and self.policy(addr).fresh(now - entry[1]):
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def read_block(self, addr, n):
+        now = time.monotonic()
+        words = array('I', bytes(4 * n))
+        missing = []
+        with self.lock:
+            for i in range(n):
+                value = self._lookup(addr + i, now)
+                if value is None:
+                    missing.append(addr + i)
+                else:
+                    words[i] = value
+        if not missing:
+            return words
+
+        with self.bus.batch() as b:
+            # the gaps are registers of the block asked for, already cached
+            futures = [(start, b.read_block(start, count))
+                       for start, count in plan_bursts(missing, max_gap=MERGE_GAP)]
+        with self.lock:
+            for start, future in futures:
+                for i, value in enumerate(future.result()):
+                    if addr <= start + i < addr + n:
+                        words[start + i - addr] = value
+                    if self.policy(start + i).fill_on_read:
+                        self.values[start + i] = (value, now)
+        return words
+
+    def write_block(self, addr, words):
+        if isinstance(words, (bytes, bytearray, memoryview)):
+            buffer, words = words, array('I')
+            words.frombytes(buffer)
+            from_wire(words)
+        else:
+            words = array('I', words)
+        self.bus.write_block(addr, words)
+        now = time.monotonic()
+        with self.lock:
+            for i, value in enumerate(words):
+                if self.policy(addr + i).fill_on_write:
+                    self.values[addr + i] = (value, now)
+                else:
+                    self.values.pop(addr + i, None)
+
+    def masked_write(self, addr, mask, value):
+        return self._store(addr, self.bus.masked_write(addr, mask, value))
+
+    def set_bits(self, addr, bits):
+        return self._store(addr, self.bus.set_bits(addr, bits))
+
+    def clear_bits(self, addr, bits):
+        return self._store(addr, self.bus.clear_bits(addr, bits))
+
+    def compare_and_swap(self, addr, expected, value):
+        old = self.bus.compare_and_swap(addr, expected, value)
+        self._store(addr, value if old == expected else old)
+        return old
+
+    def _store(self, addr, value):
+        """Keep the value a read-modify-write left in the register, return it."""
+        with self.lock:
+            if self.policy(addr).fill_on_write:
+                self.values[addr] = (value, time.monotonic())
+            else:
+                self.values.pop(addr, None)
+        return value
+
+    def read(self, addr):
+        return self.read_block(addr, 1)[0]
+
+    def write(self, addr, data):
+        self.write_block(addr, (data,))
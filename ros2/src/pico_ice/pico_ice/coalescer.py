@@ -0,0 +1,114 @@
+import threading
+
+from pico_ice.wishbone_serial import plan_bursts
+
+
+class WriteCoalescer:
+    """
+    Register writes buffered so that only the latest value of each is sent.
+
+    write() only records the value in a table of dirty registers, replacing
+    any older value still pending for that address. A flusher thread sends
+    the dirty registers as contiguous write_block() in a single batch, and
+    starts over as soon as the bus has acknowledged them, so the rate of
+    writes adapts to what the bus can absorb, and the values reaching the
+    bridge are never older than one flush.
+
+    `superseded` counts the writes dropped because a newer value came first.
+
+    The values of a flush that failed are written again, after `retry_delay`
+    seconds, unless a newer value came meanwhile, so that a transient error
+    does not leave a stale value on the bridge until the next write. Each
+    error is passed to `on_error(e)`, called from the flusher thread.
+    """
+
+    def __init__(self, bus, *, on_error=None, retry_delay=0.1):
+        self.bus = bus
+        self.on_error = on_error
+        self.retry_delay = retry_delay
+        self.dirty = {}
+        self.cond = threading.Condition()
+        self.busy = False
+        self.closed = False
+        self.written = 0
+        self.superseded = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, addr, value):
+        with self.cond:
+            self._set(addr, value)
+            self.cond.notify_all()
+
+    def write_many(self, values):
+        """Write all the addr: value pairs of `values`."""
+        with self.cond:
+            for addr, value in values.items():
+                self._set(addr, value)
+            self.cond.notify_all()
+
+    def _set(self, addr, value):
+        if addr in self.dirty:
+            self.superseded += 1
+        self.dirty[addr] = value
+
+    def flush(self, timeout=None):
+        """Wait until all pending writes reached the bus, return if they did."""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.dirty and not self.busy, timeout)
+
+    def close(self):
+        """
+        Flush the pending writes and stop the flusher thread.
+
+        The values of a flush failing at that point are dropped.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.dirty or self.closed)
+                if not self.dirty:
+                    return
+                dirty, self.dirty = self.dirty, {}
+                self.busy = True
+
+            try:
+                with self.bus.batch() as b:
+                    for addr, n in plan_bursts(dirty):
+                        b.write_block(addr, [dirty[addr + i] for i in range(n)])
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                if self.on_error is not None:
+                    self.on_error(e)
+                with self.cond:
+                    if not self.closed:
+                        self._restore(dirty)
+                        self.cond.wait_for(lambda: self.closed, self.retry_delay)
+            else:
+                self.written += len(dirty)
+                self.flushes += 1
+
+    def _restore(self, dirty):
+        """Put back the values of a failed flush, unless newer ones came."""
+        for addr, value in dirty.items():
+            if addr in self.dirty:
+                self.superseded += 1
+            else:
+                self.dirty[addr] = value
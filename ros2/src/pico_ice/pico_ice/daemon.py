@@ -0,0 +1,410 @@
+import argparse
+from collections import deque
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import serial
+
+from pico_ice.wishbone_serial import (
+    _HEADER, CMD_READ, CMD_WRITE, DEFAULT_TIMEOUT, is_rmw, UNIX_PREFIX, WishboneBus,
+    WishboneError)
+
+
+DEFAULT_SOCKET = '/tmp/pico_ice.sock'
+
+# frames taken from a client at each of its turns, and bytes of frames and
+# replies in flight on the bridge, after which the next frames wait: this
+# bounds the time a client waits behind the bursts of the others
+QUANTUM = 16
+MAX_INFLIGHT = 4096
+
+# frames queued and bytes of reply not yet sent to a client, after which
+# nothing more is read from it until it catches up
+MAX_QUEUED = 256
+MAX_BACKLOG = 65536
+
+
+class DaemonClient:
+    """One connection to a BridgeDaemon, with its frames and replies."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.input = bytearray()
+        self.frames = deque()
+        self.out = bytearray()
+        self.irqs = bytearray()
+        self.pending = 0
+        self.closed = False
+        self.events = selectors.EVENT_READ
+
+    @property
+    def idle(self):
+        return not self.pending and not self.frames
+
+    def parse(self):
+        """
+        Cut the input in frames, each queued with the size of its reply.
+
+        A read-modify-write is queued with the read of its result following
+        it, so that no frame of another client comes in-between.
+        """
+        pos = 0
+        while True:
+            end, size, rmw = self._frame(pos)
+            if rmw and end is not None:
+                end, result, _ = self._frame(end)
+                size += result or 0
+            if end is None:
+                break
+            self.frames.append((bytes(self.input[pos:end]), size))
+            pos = end
+        del self.input[:pos]
+
+    def _frame(self, pos):
+        """
+        Parse the frame at `pos` in the input.
+
+        Return the end of the frame, the size of its reply, and whether it
+        is a read-modify-write, with no end if it is incomplete.
+        """
+        if len(self.input) - pos < _HEADER.size:
+            return None, None, False
+        cmd, length, addr = _HEADER.unpack_from(self.input, pos)
+        if cmd == CMD_WRITE:
+            end, size = pos + _HEADER.size + length, 1
+        elif cmd == CMD_READ:
+            end, size = pos + _HEADER.size, length
+        else:
+            raise WishboneError(f'invalid command byte: 0x{cmd:02x}')
+        if end > len(self.input):
+            return None, None, False
+        return end, size, is_rmw(cmd, addr)
+
+    def reply(self, data):
+        if self.closed:
+            return
+        if not self.out:
+            # sent right away, which leaves the shortest window for an IRQ
+            # to cross a frame the client is sending at the same time
+            try:
+                data = data[self.sock.send(data):]
+            except OSError:
+                pass
+        self.out += data
+
+    def irq(self, data):
+        """Send IRQ bytes now if no transfer is pending, or once it is done."""
+        if self.idle:
+            self.reply(data)
+        else:
+            self.irqs += data
+
+    def done(self):
+        self.pending -= 1
+        if self.idle and self.irqs:
+            self.reply(self.irqs)
+            self.irqs.clear()
+
+
+class BridgeDaemon:
+    """
+    Single owner of a bridge, shared with other processes through a Unix socket.
+
+    A serial port can only be used by one process, as the frames of several
+    would be mixed on the wire. The daemon opens it alone, and serves clients
+    speaking the same protocol on the socket at `path`: WishboneBus and the
+    other buses accept `unix:PATH` in place of the port.
+
+    The frames of all clients are sent to the bridge together, a QUANTUM of
+    frames from each client in turn, so that a client reading a large region
+    does not stall the others. The replies come back in order, and are cut
+    and sent back to the client of each frame. IRQ bytes go to every client,
+    in-between the replies of its own transfers.
+
+        daemon = BridgeDaemon('/dev/ttyACM1', '/tmp/pico_ice.sock')
+        bus = WishboneBus('unix:/tmp/pico_ice.sock')
+    """
+
+    def __init__(self, port, path=DEFAULT_SOCKET, *, timeout=DEFAULT_TIMEOUT):
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.bus = WishboneBus(port, timeout=timeout)
+        os.set_blocking(self.bus.fd, False)
+        self.listener = self._listen(path)
+
+        self.clients = deque()
+        self.out = bytearray()
+        self.replies = deque()
+        self.inflight = 0
+        self.last_progress = time.monotonic()
+        self.served = 0
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, self.listener)
+        self.bus_events = selectors.EVENT_READ
+        self.selector.register(self.bus.fd, self.bus_events, self.bus)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='pico_ice daemon', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def url(self):
+        """Port to give to the buses to connect to this daemon."""
+        return UNIX_PREFIX + self.path
+
+    @staticmethod
+    def _listen(path):
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                # left by a daemon that did not exit cleanly
+                os.unlink(path)
+            else:
+                raise WishboneError(f'{path}: another daemon is already listening')
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        listener.setblocking(False)
+        return listener
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            os.write(self._wakeup_w, b'\x00')
+        except BlockingIOError:
+            pass
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _schedule(self):
+        """Move the frames of the clients to the output, a QUANTUM each in turn."""
+        while self.inflight < MAX_INFLIGHT:
+            progress = False
+            for _ in range(len(self.clients)):
+                client = self.clients[0]
+                self.clients.rotate(-1)
+                for _ in range(QUANTUM):
+                    if not client.frames or self.inflight >= MAX_INFLIGHT:
+                        break
+                    frame, size = client.frames.popleft()
+                    if not self.replies:
+                        self.last_progress = time.monotonic()
+                    self.out += frame
+                    self.replies.append([client, size, len(frame) + size])
+                    self.inflight += len(frame) + size
+                    client.pending += 1
+                    progress = True
+            if not progress:
+                break
+        # replies of size 0 do not need any byte from the bridge
+        self._route(b'')
+
+    def _route(self, data):
+        """Send the bytes from the bridge to the clients awaiting them."""
+        pos = 0
+        while self.replies:
+            entry = self.replies[0]
+            client, size, cost = entry
+            n = min(size, len(data) - pos)
+            if n:
+                client.reply(data[pos:pos + n])
+                pos += n
+                entry[1] -= n
+            if entry[1]:
+                return
+            self.replies.popleft()
+            self.inflight -= cost
+            self.served += 1
+            client.done()
+        if pos < len(data):
+            irqs = data[pos:]
+            if self.bus.trace is not None:
+                self.bus.trace.irq(irqs)
+            for client in self.clients:
+                client.irq(irqs)
+
+    def _resync(self):
+        """Drop the transfers the bridge did not reply to, and realign with it."""
+        while self.replies:
+            client, _, cost = self.replies.popleft()
+            self.inflight -= cost
+            # the client times out on its own, and resynchronizes itself
+            # through the daemon, with no need for the bytes dropped here
+            client.done()
+        self.out.clear()
+        try:
+            with self.bus.lock:
+                self.bus._resync()
+        except WishboneError as e:
+            # keep serving: the next transfers may find the bridge back
+            print(e, file=sys.stderr)
+        self.last_progress = time.monotonic()
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = DaemonClient(sock)
+        self.clients.append(client)
+        self.selector.register(sock, client.events, client)
+
+    def _drop(self, client):
+        client.closed = True
+        client.frames.clear()
+        self.clients.remove(client)
+        self.selector.unregister(client.sock)
+        client.sock.close()
+
+    def _on_client(self, client, mask):
+        if mask & selectors.EVENT_WRITE:
+            try:
+                del client.out[:client.sock.send(client.out)]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._drop(client)
+                return
+        if mask & selectors.EVENT_READ:
+            try:
+                data = client.sock.recv(4096)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b''
+            if not data:
+                self._drop(client)
+                return
+            client.input += data
+            try:
+                client.parse()
+            except WishboneError as e:
+                print(f'{self.path}: client dropped: {e}', file=sys.stderr)
+                self._drop(client)
+
+    def _on_bus(self, mask):
+        if mask & selectors.EVENT_WRITE:
+            try:
+                n = os.write(self.bus.fd, self.out)
+            except BlockingIOError:
+                n = 0
+            if self.bus.trace is not None:
+                self.bus.trace.tx(self.out[:n])
+            del self.out[:n]
+        if mask & selectors.EVENT_READ:
+            try:
+                data = os.read(self.bus.fd, 4096)
+            except BlockingIOError:
+                return
+            if not data:
+                raise serial.SerialException(f'{self.port}: device disconnected')
+            self.last_progress = time.monotonic()
+            if self.bus.trace is not None and self.replies:
+                self.bus.trace.rx(data)
+            self._route(data)
+
+    def _update_events(self):
+        for client in self.clients:
+            events = 0
+            if len(client.frames) < MAX_QUEUED and len(client.out) < MAX_BACKLOG:
+                events |= selectors.EVENT_READ
+            if client.out:
+                events |= selectors.EVENT_WRITE
+            if events != client.events:
+                self.selector.modify(client.sock, events, client)
+                client.events = events
+        events = selectors.EVENT_READ
+        if self.out:
+            events |= selectors.EVENT_WRITE
+        if events != self.bus_events:
+            self.selector.modify(self.bus.fd, events, self.bus)
+            self.bus_events = events
+
+    def _run(self):
+        try:
+            while not self.closed:
+                self._schedule()
+                self._update_events()
+                timeout = None
+                if self.replies:
+                    timeout = max(0.0, self.last_progress + self.timeout - time.monotonic())
+                ready = self.selector.select(timeout)
+                if self.replies and time.monotonic() - self.last_progress >= self.timeout:
+                    self._resync()
+                for key, mask in ready:
+                    if key.data is None:
+                        while True:
+                            try:
+                                os.read(self._wakeup_r, 4096)
+                            except BlockingIOError:
+                                break
+                    elif key.data is self.listener:
+                        self._accept()
+                    elif key.data is self.bus:
+                        self._on_bus(mask)
+                    elif not key.data.closed:
+                        self._on_client(key.data, mask)
+        finally:
+            self.closed = True
+            for client in list(self.clients):
+                self._drop(client)
+            self.selector.close()
+            self.listener.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self.bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='share a wishbone bridge between processes through a Unix socket')
+    parser.add_argument('--serial', dest='serial', required=True,
+                        help='serial port of the bridge, opened by the daemon alone')
+    parser.add_argument('--socket', dest='socket', default=DEFAULT_SOCKET,
+                        help=f'path of the socket to listen on (default: {DEFAULT_SOCKET})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds to wait for a reply before resynchronizing with the bridge')
+    args = parser.parse_args()
+
+    try:
+        daemon = BridgeDaemon(args.serial, args.socket, timeout=args.timeout)
+    except (OSError, serial.SerialException, WishboneError) as e:
+        sys.exit(f'{parser.prog}: {e}')
+    print(f'serving {args.serial} on {daemon.url}', flush=True)
+    try:
+        while daemon.thread.is_alive():
+            daemon.thread.join(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == '__main__':
+    main()
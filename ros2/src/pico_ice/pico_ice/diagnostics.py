@@ -0,0 +1,61 @@
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+from pico_ice.stats import BusStats
+
+
+def bus_status(name, port, snapshot):
+    """Convert a BusStats.snapshot() into a DiagnosticStatus message."""
+    status = DiagnosticStatus()
+    status.name = f'pico_ice: {name}'
+    status.hardware_id = port
+    if snapshot['timeouts'] or snapshot['bad_acks']:
+        status.level = DiagnosticStatus.WARN
+        status.message = 'transfer errors'
+    else:
+        status.level = DiagnosticStatus.OK
+        status.message = 'ok'
+
+    values = [(key, snapshot[key]) for key in
+              ('tx_bytes', 'rx_bytes', 'tx_bytes_per_s', 'rx_bytes_per_s',
+               'errors', 'timeouts', 'bad_acks', 'retries', 'resyncs')]
+    for op, s in snapshot['ops'].items():
+        values += [(f'{op}.{key}', value) for key, value in s.items()]
+    status.values = [KeyValue(key=key, value=f'{value:.6g}' if isinstance(value, float)
+                              else str(value)) for key, value in values]
+    return status
+
+
+class BusDiagnostics:
+    """
+    Periodic publisher of the statistics of buses on /diagnostics.
+
+    Enables the statistics on every bus of the `buses` dict name: bus, and
+    publishes them every `period` seconds from a timer of `node`.
+    `extra` may hold callables returning more values to report for a bus.
+    """
+
+    def __init__(self, node, buses, *, period=1.0, extra=None):
+        self.node = node
+        self.buses = buses
+        self.extra = extra or {}
+        for bus in buses.values():
+            if bus.stats is None:
+                bus.stats = BusStats()
+        self.publisher = node.create_publisher(DiagnosticArray, '/diagnostics', 10)
+        self.timer = node.create_timer(period, self.publish)
+
+    def snapshot(self):
+        """Return the statistics of all buses, as a dict name: snapshot."""
+        return {name: bus.stats.snapshot() for name, bus in self.buses.items()}
+
+    def publish(self):
+        msg = DiagnosticArray()
+        msg.header.stamp = self.node.get_clock().now().to_msg()
+        for name, snapshot in self.snapshot().items():
+            port = self.buses[name].port
+            status = bus_status(port if name is None else str(name), port, snapshot)
+            if name in self.extra:
+                status.values += [KeyValue(key=key, value=str(value))
+                                  for key, value in self.extra[name]().items()]
+            msg.status.append(status)
+        self.publisher.publish(msg)
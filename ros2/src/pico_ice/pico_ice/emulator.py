@@ -0,0 +1,202 @@
+import argparse
+from collections import deque
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from pico_ice.wishbone_serial import ACK, CAS, CMD_READ, CMD_WRITE, FIFO, MASKED, RESULT
+
+
+# command, length, address
+_HEADER = struct.Struct('>BBI')
+_WORD = struct.Struct('>I')
+
+
+class BridgeEmulator:
+    """
+    Stand-in for the pico-ice Wishbone-serial bridge, over a pseudo-terminal.
+
+    This speaks the same protocol as the firmware's
+    ice_wishbone_serial_read_cb() and ice_wishbone_serial_write_cb(), with
+    `registers` as the memory behind the bus. `latency` seconds of delay
+    are added once per chunk of data received, to mimic the USB round trip,
+    and `frame_latency` seconds for each frame, to mimic the time the bridge
+    takes to execute it. Open `port` with any of the clients to access it.
+
+    raise_irq() sends an IRQ byte the next time the bridge is idle, that is
+    with no frame received but not yet replied to. Line 0 is the ACK byte,
+    which the clients never take as an IRQ. cross_irq() sends it right
+    before the reply of the next frame instead, as the bridge does when an
+    IRQ crosses a frame on its way to it.
+
+    push() fills a FIFO, read with FIFO set in the address, with `count_addr`
+    holding the number of words it contains. An empty FIFO reads `default`.
+
+    Writes with MASKED or CAS set in the address modify the register as the
+    firmware does, and keep the result for the next read at RESULT.
+
+        with BridgeEmulator(latency=0.001) as emu:
+            wishbone_serial.write(emu.port, 0x1000, 1234)
+    """
+
+    def __init__(self, *, latency=0.0, frame_latency=0.0, registers=None,
+                 default=0xFFFFFFFF):
+        self.latency = latency
+        self.frame_latency = frame_latency
+        self.registers = {} if registers is None else registers
+        self.default = default
+        self.frames = 0
+        self.irqs = deque()
+        self.crossing = deque()
+        self.fifos = {}
+        self.fifo_counts = {}
+        self.result = default
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._thread is None:
+            return
+        os.write(self._wakeup_w, b'\x00')
+        self._thread.join()
+        self._thread = None
+        for fd in (self.master, self.slave, self._wakeup_r, self._wakeup_w):
+            os.close(fd)
+
+    def raise_irq(self, line=1):
+        self.irqs.append(line)
+        os.write(self._wakeup_w, b'\x01')
+
+    def cross_irq(self, line=1):
+        self.crossing.append(line)
+
+    def push(self, addr, words, *, count_addr=None):
+        """Append `words` to the FIFO at `addr`, creating it if needed."""
+        self.fifos.setdefault(addr, deque()).extend(words)
+        if count_addr is not None:
+            self.fifo_counts[count_addr] = addr
+
+    def _read(self, addr):
+        fifo = self.fifos.get(addr)
+        if fifo is not None:
+            return fifo.popleft() if fifo else self.default
+        if addr in self.fifo_counts:
+            return len(self.fifos[self.fifo_counts[addr]])
+        return self.registers.get(addr, self.default)
+
+    def read_cb(self, addr, size):
+        if addr & RESULT == RESULT:
+            return _WORD.pack(self.result) * (size // 4)
+        step = 0 if addr & FIFO else 1
+        addr &= ~FIFO
+        return b''.join(_WORD.pack(self._read(addr + i * step)) for i in range(size // 4))
+
+    def write_cb(self, addr, data):
+        if addr & RESULT and len(data) == 8:
+            a, b = struct.unpack('>II', data)
+            reg = addr & ~(RESULT | FIFO)
+            old = self.registers.get(reg, self.default)
+            if addr & RESULT == MASKED:
+                self.result = self.registers[reg] = old & ~a | b & a
+            elif addr & RESULT == CAS:
+                self.result = old
+                if old == a:
+                    self.registers[reg] = b
+            return
+        step = 0 if addr & FIFO else 1
+        addr &= ~FIFO
+        # the bytes of an incomplete last word, such as from a garbled frame, are dropped
+        for i, (word,) in enumerate(_WORD.iter_unpack(data[:len(data) & ~3])):
+            self.registers[addr + i * step] = word
+
+    def _run(self):
+        buffer = bytearray()
+        while True:
+            ready, _, _ = select.select([self.master, self._wakeup_r], [], [])
+            if self._wakeup_r in ready and 0 in os.read(self._wakeup_r, 4096):
+                return
+            if self.master in ready:
+                buffer += os.read(self.master, 4096)
+                if self.latency:
+                    time.sleep(self.latency)
+                reply = bytearray()
+                while True:
+                    n = self._handle(buffer, reply)
+                    if n == 0:
+                        break
+                    del buffer[:n]
+                self._send(reply)
+            if self.irqs and not buffer:
+                ready, _, _ = select.select([self.master], [], [], 0)
+                if not ready:
+                    self._send(bytes(self.irqs.popleft() for _ in range(len(self.irqs))))
+
+    def _send(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master, view):]
+
+    def _handle(self, buffer, reply):
+        """Execute the frame at the start of `buffer`, return its size."""
+        if len(buffer) < _HEADER.size:
+            return 0
+        cmd, length, addr = _HEADER.unpack_from(buffer)
+        start = len(reply)
+
+        if cmd == CMD_READ:
+            size = _HEADER.size
+            reply += self.read_cb(addr, length)
+        elif cmd == CMD_WRITE:
+            size = _HEADER.size + length
+            if len(buffer) < size:
+                return 0
+            self.write_cb(addr, bytes(buffer[_HEADER.size:size]))
+            reply.append(ACK)
+        else:
+            # not a command: drop the byte to get back in sync
+            return 1
+
+        if self.crossing:
+            reply[start:start] = bytes([self.crossing.popleft()])
+        self.frames += 1
+        if self.frame_latency:
+            time.sleep(self.frame_latency)
+        return size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='emulate a pico-ice Wishbone-serial bridge on a pseudo-terminal')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='delay in seconds before replying to each chunk received')
+    parser.add_argument('--frame-latency', type=float, default=0.0,
+                        help='delay in seconds to execute each frame')
+    args = parser.parse_args()
+
+    with BridgeEmulator(latency=args.latency, frame_latency=args.frame_latency) as emu:
+        print(emu.port, flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
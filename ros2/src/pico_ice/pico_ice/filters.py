@@ -0,0 +1,102 @@
+import math
+
+
+class Filter:
+    """
+    Policy deciding whether a new value of a register is worth publishing.
+
+    accept() is called with the `value` just read, the `last` value that
+    was published (None if none was) and the seconds `elapsed` since then
+    (infinite if never). The value is published if all the filters accept
+    it, or if any of them requests a heartbeat.
+    """
+
+    def accept(self, value, last, elapsed):
+        return True
+
+    def heartbeat(self, elapsed):
+        return False
+
+
+class IfNot(Filter):
+    """
+    Publish unless the register holds `value`, such as 0xFF for 'empty'.
+
+    For the array of values of a block of registers, unless all of them do.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def accept(self, value, last, elapsed):
+        if isinstance(value, int):
+            return value != self.value
+        return any(v != self.value for v in value)
+
+
+class OnChange(Filter):
+    """Publish only when the value differs from the last one published."""
+
+    def accept(self, value, last, elapsed):
+        return value != last
+
+
+class Deadband(Filter):
+    """
+    Publish only when the value moved by more than `delta`.
+
+    For the array of values of a block of registers, when any of them did.
+    """
+
+    def __init__(self, delta):
+        self.delta = delta
+
+    def accept(self, value, last, elapsed):
+        if last is None:
+            return True
+        if isinstance(value, int):
+            return abs(value - last) > self.delta
+        return len(value) != len(last) or any(
+            abs(a - b) > self.delta for a, b in zip(value, last))
+
+
+class RateLimit(Filter):
+    """
+    Publish at most once every `min_interval` seconds.
+
+    With `max_silence`, the value is also published if nothing was for that
+    many seconds, even if other filters reject it, as a heartbeat.
+    """
+
+    def __init__(self, min_interval, max_silence=None):
+        self.min_interval = min_interval
+        self.max_silence = max_silence
+
+    def accept(self, value, last, elapsed):
+        return elapsed >= self.min_interval
+
+    def heartbeat(self, elapsed):
+        return self.max_silence is not None and elapsed >= self.max_silence
+
+
+class Shadow:
+    """Copy of the last value published for a register, checked by filters."""
+
+    def __init__(self, filters=()):
+        self.filters = tuple(filters)
+        self.value = None
+        self.time = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def update(self, value, now):
+        """Return whether `value` read at time `now` is to be published."""
+        elapsed = math.inf if self.time is None else now - self.time
+        if (all(f.accept(value, self.value, elapsed) for f in self.filters)
+                or any(f.heartbeat(elapsed) for f in self.filters)):
+            self.value = value
+            self.time = now
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        return False
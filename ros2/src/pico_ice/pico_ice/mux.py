@@ -0,0 +1,312 @@
+from collections import deque
+from concurrent.futures import Future
+import os
+import queue
+import selectors
+import threading
+import time
+
+from pico_ice.wishbone_serial import (
+    BaseBus, DEFAULT_TIMEOUT, OP_RAW, open_port, ReplyQueue, Resync,
+    WishboneError, WishboneTimeout)
+
+
+class MuxDevice(BaseBus):
+    """
+    One pico-ice bridge driven by a BusMultiplexer.
+
+    It offers the same methods as a WishboneBus, but the transfers are
+    queued to the I/O thread of the multiplexer, so any number of threads
+    may use it. Batch.submit() returns immediately, which allows to have
+    transfers in flight on all devices at once. Closing a device leaves the
+    other devices of the multiplexer running.
+
+    When no reply comes for `timeout` seconds while some are pending, they
+    fail with WishboneTimeout, and the stream is resynchronized before the
+    next requests are sent, without blocking the other devices. So is it
+    when a reply fails its ACK check, failing the replies after it.
+    """
+
+    def __init__(self, mux, name, port, *, timeout=DEFAULT_TIMEOUT):
+        self.mux = mux
+        self.name = name
+        self.port = port
+        self.timeout = timeout
+        self.deadline = None
+        self.resync = None
+        self.closed = False
+        self.serial = open_port(port, timeout=0)
+        self.fd = self.serial.fileno()
+        os.set_blocking(self.fd, False)
+        self.lock = threading.Lock()
+        self.requests = deque()
+        self.replies = ReplyQueue(on_irq=self._queue_irq)
+        self.out = bytearray()
+        self.events = selectors.EVENT_READ
+        self.irq_handlers = {}
+        self.irqs = queue.SimpleQueue()
+
+    @property
+    def is_open(self):
+        return not self.closed and self.serial.is_open
+
+    def close(self):
+        """Close this device alone, failing its pending transfers."""
+        self.closed = True
+        self.mux.wakeup()
+
+    def _submit(self, frames, size, op='batch'):
+        future = Future()
+        stats = self.stats
+        if stats is not None:
+            # recorded from the I/O thread, which resolves the future
+            t0 = time.perf_counter_ns()
+
+            def record(future):
+                if future.exception() is None:
+                    stats.record(op, len(frames), size, time.perf_counter_ns() - t0)
+                else:
+                    stats.record_error(future.exception())
+
+            future.add_done_callback(record)
+        with self.lock:
+            if self.closed or self.mux.closed:
+                future.set_exception(WishboneError(f'{self.name}: device closed'))
+                return future
+            self.requests.append((frames, size, future))
+        self.mux.wakeup()
+        return future
+
+    def _transfer(self, frames, size, op='batch', acks=None):
+        # the I/O thread checks the ACKs of all the writes in `frames`
+        return self._submit(frames, size, op).result()
+
+    def _queue_irq(self, line):
+        self.irqs.put(line)
+
+    def poll_irq(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for IRQs, and dispatch them to handlers.
+
+        The handlers are called from the calling thread, never from the I/O
+        thread, so they can access the bus.
+        """
+        try:
+            line = self.irqs.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        n = 0
+        while True:
+            self._dispatch_irq(line)
+            n += 1
+            try:
+                line = self.irqs.get_nowait()
+            except queue.Empty:
+                return n
+
+    def _take_requests(self):
+        """Move the requests of other threads to the output buffer (I/O thread)."""
+        if self.resync is not None:
+            # sent once the stream is aligned again
+            return
+        with self.lock:
+            requests, self.requests = self.requests, deque()
+        if requests and not self.replies:
+            self.deadline = time.monotonic() + self.timeout
+        for frames, size, future in requests:
+            self.replies.push(OP_RAW, size, future, frames)
+            self.out += frames
+        if requests:
+            # replies of size 0 do not need any byte from the device
+            self.replies.feed(b'')
+
+    def _check_timeout(self):
+        """
+        Time out the late replies, and drive the resync (I/O thread).
+
+        The replies late by more than `timeout` fail, and the stream is
+        resynchronized before the next requests are sent. Return the seconds
+        until the next call is needed, None if none is.
+        """
+        if self.resync is None:
+            if not self.replies:
+                return None
+            left = self.deadline - time.monotonic()
+            if left > 0:
+                return left
+            self._resync(WishboneTimeout(f'{self.port}: no reply for {self.timeout} s'))
+
+        left = self.resync.poll()
+        self.out += self.resync.output
+        self.resync.output.clear()
+        if self.resync.error is not None:
+            with self.lock:
+                requests, self.requests = self.requests, deque()
+            for _, _, future in requests:
+                future.set_exception(self.resync.error)
+        if self.resync.done or self.resync.error is not None:
+            self.resync = None
+            return 0
+        return left
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if not data:
+            self._fail(WishboneError(f'{self.port}: end of file'))
+            return
+        if self.trace is not None:
+            self.trace.rx(data)
+        if self.resync is not None:
+            self.resync.feed(data)
+            return
+        error = self.replies.feed(data)
+        if error is not None:
+            self._resync(error)
+            return
+        self.deadline = time.monotonic() + self.timeout
+
+    def _resync(self, error):
+        """Fail the pending replies with `error`, and resynchronize (I/O thread)."""
+        self.replies.fail(error)
+        # the rest of the frames are sent once the stream is aligned again
+        self.out.clear()
+        if self.stats is not None:
+            self.stats.record_resync()
+        self.resync = Resync(self.port)
+
+    def _on_writable(self):
+        try:
+            n = os.write(self.fd, self.out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if self.trace is not None:
+            self.trace.tx(self.out[:n])
+        del self.out[:n]
+        if n:
+            self.deadline = time.monotonic() + self.timeout
+
+    def _fail(self, error):
+        self.out.clear()
+        self.resync = None
+        self.replies.fail(error)
+
+    def _shutdown(self, error):
+        """Fail all the transfers and close the port (I/O thread)."""
+        with self.lock:
+            self.closed = True
+            requests, self.requests = self.requests, deque()
+        for _, _, future in requests:
+            future.set_exception(error)
+        self._fail(error)
+        self.serial.close()
+
+
+class BusMultiplexer:
+    """
+    Several pico-ice bridges driven from a single I/O thread.
+
+    Each device has its own queue of requests and of pending replies, and a
+    selector waits on all of them at once, writing the frames of a device as
+    soon as it accepts them and parsing its replies as soon as they arrive.
+    Every device progresses independently, so the throughput adds up with
+    the number of boards, with a single thread. A device whose replies stop
+    for `timeout` seconds is resynchronized on its own.
+
+        mux = BusMultiplexer({'front': '/dev/ttyACM1', 'rear': '/dev/ttyACM3'})
+        b1, b2 = mux['front'].batch(), mux['rear'].batch()
+        x1, x2 = b1.read(0x1000), b2.read(0x1000)
+        b1.submit(), b2.submit()
+        print(x1.result(), x2.result())
+    """
+
+    def __init__(self, ports, *, timeout=DEFAULT_TIMEOUT):
+        self.selector = selectors.DefaultSelector()
+        self.devices = {name: MuxDevice(self, name, port, timeout=timeout)
+                        for name, port in ports.items()}
+        for device in self.devices.values():
+            self.selector.register(device.fd, selectors.EVENT_READ, device)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\x00')
+        except BlockingIOError:
+            # the I/O thread already has a wakeup pending
+            pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _run(self):
+        devices = list(self.devices.values())
+        while not self.closed:
+            timeout = None
+            for device in list(devices):
+                if device.closed:
+                    devices.remove(device)
+                    self.selector.unregister(device.fd)
+                    device._shutdown(WishboneError(f'{device.name}: device closed'))
+                    continue
+                left = device._check_timeout()
+                if left is not None and (timeout is None or left < timeout):
+                    timeout = left
+                device._take_requests()
+                events = selectors.EVENT_READ
+                if device.out:
+                    events |= selectors.EVENT_WRITE
+                if events != device.events:
+                    self.selector.modify(device.fd, events, device)
+                    device.events = events
+
+            for key, mask in self.selector.select(timeout):
+                device = key.data
+                if device is None:
+                    while True:
+                        try:
+                            os.read(self._wakeup_r, 4096)
+                        except BlockingIOError:
+                            break
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    device._on_writable()
+                if mask & selectors.EVENT_READ:
+                    device._on_readable()
+
+        for device in devices:
+            self.selector.unregister(device.fd)
+            device._shutdown(WishboneError('multiplexer closed'))
+        self.selector.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
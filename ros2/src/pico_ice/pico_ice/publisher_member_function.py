@@ -12,14 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 import rclpy
+from rclpy.executors import MultiThreadedExecutor
 from rclpy.node import Node
-from std_msgs.msg import String
+from std_msgs.msg import UInt32
 import std_msgs.msg as message
 
 from pico_ice import wishbone_serial
+from pico_ice.filters import OnChange, RateLimit, Shadow
+from pico_ice.registers import IMU
+from pico_ice.worker import BusWorker
 
 
+# default of the `port` parameter, either a serial port or unix:PATH of a daemon
 tty = '/dev/ttyACM1'
 
 
@@ -27,22 +34,42 @@ class PicoIcePublisher(Node):
 
     def __init__(self, addr):
         super().__init__('pico_ice_publisher')
-        self.publisher_ = self.create_publisher(String, 'topic', 10)
+        self.declare_parameter('port', tty)
+        self.publisher_ = self.create_publisher(UInt32, 'topic', 10)
         self.timer = self.create_timer(0.5, self.timer_callback)
         self.addr = addr
+        self.port = self.get_parameter('port').value
+        self.worker = BusWorker(depth=1)
+        self.shadow = Shadow([OnChange(), RateLimit(0, max_silence=10.0)])
 
     def timer_callback(self):
-        msg = String()
-        value = wishbone_serial.read(tty, self.addr)
-        msg.data = f'{value}'
+        # the read is done by the worker thread, so a slow bus never blocks the executor;
+        # read() releases the bus if the device went away, and opens it again next time
+        self.worker.submit(wishbone_serial.read, self.port, self.addr, key='read',
+                           callback=self.read_callback)
+
+    def read_callback(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.get_logger().error(f'read failed: {future.exception()}')
+            return
+        value = future.result()
+        if not self.shadow.update(value, time.monotonic()):
+            return
+        msg = UInt32()
+        msg.data = value
         self.publisher_.publish(msg)
-        self.get_logger().info('Publishing: "%s"' % msg.data)
+        self.get_logger().debug(f'Publishing: {value}')
 
 
 def main(args=None):
     rclpy.init(args=args)
-    pico_ice_publisher = PicoIcePublisher(0x1001)
-    rclpy.spin(pico_ice_publisher)
+    pico_ice_publisher = PicoIcePublisher(IMU.address('y'))
+    executor = MultiThreadedExecutor()
+    executor.add_node(pico_ice_publisher)
+    executor.spin()
+    pico_ice_publisher.worker.close()
     rclpy.shutdown()
     help(message)
 
@@ -0,0 +1,14 @@
+from pico_ice.regmap import Register, RegisterMap
+
+
+# registers whose reads have side effects, never read unless asked for: the
+# oldest code of the IR FIFO, taken out by the read, see amaranth/top.py
+VOLATILE = range(0x2000, 0x2001)
+
+# orientation displayed by the firmware on the OLED screen, in thousandths,
+# see reg_read() and reg_write() in main.c
+IMU = RegisterMap(0x1000, [
+    Register('x', 0, signed=True, scale=0.001),
+    Register('y', 1, signed=True, scale=0.001),
+    Register('z', 2, signed=True, scale=0.001),
+])
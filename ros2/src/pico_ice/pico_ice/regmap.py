@@ -0,0 +1,154 @@
+from array import array
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Register:
+    """
+    32-bit register at `offset` words from the base of a RegisterMap.
+
+    The raw value is interpreted as `signed` or not, then multiplied by
+    `scale` if given, such as 0.001 for values in thousandths. `bits` maps
+    the names of bitfields to their (lsb, width) within the register, which
+    are then decoded instead of the register as a whole, as unsigned and
+    unscaled integers: `signed` and `scale` cannot be given with them.
+    """
+
+    def __init__(self, name, offset, *, signed=False, scale=None, bits=None):
+        if bits and (signed or scale is not None):
+            raise ValueError(f'{name}: bitfields cannot be signed or scaled')
+        self.name = name
+        self.offset = offset
+        self.signed = signed
+        self.scale = scale
+        self.bits = bits or {}
+
+    @property
+    def fmt(self):
+        return 'i' if self.signed else 'I'
+
+
+class RegisterMap:
+    """
+    Description of a block of registers, compiled into codecs once.
+
+    decode() converts a burst read of the whole block into a dict of named
+    values with a single struct.unpack_from(), and decode_many() converts a
+    burst read of many consecutive blocks (such as samples from a FIFO) into
+    one NumPy array per field, with no per-word Python code, if NumPy is
+    available.
+
+        IMU = RegisterMap(0x1000, [
+            Register('x', 0, signed=True, scale=0.001),
+            Register('y', 1, signed=True, scale=0.001),
+        ])
+        values = IMU.decode(bus.read_block(IMU.base, IMU.size))
+    """
+
+    def __init__(self, base, registers):
+        self.base = base
+        self.registers = sorted(registers, key=lambda r: r.offset)
+        self.by_name = {r.name: r for r in self.registers}
+        self.size = self.registers[-1].offset + 1 if self.registers else 0
+
+        # words are in native order once out of read_block(), gaps are skipped
+        fmt = '='
+        pos = 0
+        for r in self.registers:
+            fmt += 'xxxx' * (r.offset - pos) + r.fmt
+            pos = r.offset + 1
+        self.struct = struct.Struct(fmt)
+
+        self.dtype = None
+        if numpy is not None:
+            self.dtype = numpy.dtype({
+                'names': [r.name for r in self.registers],
+                'formats': ['=i4' if r.signed else '=u4' for r in self.registers],
+                'offsets': [r.offset * 4 for r in self.registers],
+                'itemsize': self.size * 4,
+            })
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def address(self, name):
+        return self.base + self.by_name[name].offset
+
+    def decode(self, words):
+        """Decode a block of native-order words, as from read_block()."""
+        return self._convert(self.struct.unpack_from(words))
+
+    def _convert(self, raws):
+        values = {}
+        for r, raw in zip(self.registers, raws):
+            if r.bits:
+                for name, (lsb, width) in r.bits.items():
+                    values[name] = (raw >> lsb) & ((1 << width) - 1)
+            elif r.scale is not None:
+                values[r.name] = raw * r.scale
+            else:
+                values[r.name] = raw
+        return values
+
+    def decode_many(self, words):
+        """
+        Decode consecutive blocks of native-order words into arrays.
+
+        Return a dict with an array of values for each register or bitfield.
+        Without NumPy, lists are returned instead.
+        """
+        if self.dtype is None:
+            rows = [self._convert(raws) for raws in
+                    self.struct.iter_unpack(memoryview(words).cast('B'))]
+            return {name: [row[name] for row in rows] for name in rows[0]} if rows else {}
+
+        blocks = numpy.frombuffer(words, dtype=self.dtype)
+        values = {}
+        for r in self.registers:
+            raw = blocks[r.name]
+            if r.bits:
+                for name, (lsb, width) in r.bits.items():
+                    values[name] = (raw >> lsb) & ((1 << width) - 1)
+            elif r.scale is not None:
+                values[r.name] = raw * r.scale
+            else:
+                values[r.name] = raw
+        return values
+
+    def _raw(self, r, values):
+        if r.bits:
+            raw = 0
+            for name, (lsb, width) in r.bits.items():
+                raw |= (int(values.get(name, 0)) & ((1 << width) - 1)) << lsb
+            return raw
+        raw = values.get(r.name, 0)
+        return round(raw / r.scale) if r.scale is not None else int(raw)
+
+    def encode(self, values):
+        """
+        Encode a dict of named values into words for write_block().
+
+        Registers missing from `values`, and gaps between registers, are
+        written as 0. Scaled values are rounded to the nearest raw value.
+        """
+        words = array('I', bytes(self.size * 4))
+        self.struct.pack_into(words, 0, *(self._raw(r, values) for r in self.registers))
+        return words
+
+    def encode_dict(self, values):
+        """Encode only the registers present in `values`, as a dict addr: word."""
+        return {self.base + r.offset: self._raw(r, values) & 0xFFFFFFFF
+                for r in self.registers
+                if r.name in values or any(name in values for name in r.bits)}
+
+    def read(self, bus):
+        """Read the whole block from `bus` and decode it."""
+        return self.decode(bus.read_block(self.base, self.size))
+
+    def write(self, bus, values):
+        """Encode `values` and write the whole block to `bus`."""
+        bus.write_block(self.base, self.encode(values))
@@ -0,0 +1,393 @@
+from array import array
+import itertools
+import threading
+import time
+
+import rclpy
+from rclpy.callback_groups import ReentrantCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
+from rclpy.logging import LoggingSeverity
+from rclpy.node import Node
+from rclpy.qos import QoSProfile
+import serial
+from std_msgs.msg import Int32, Int32MultiArray, String, UInt32, UInt32MultiArray
+
+from pico_ice import wishbone_serial
+from pico_ice.coalescer import WriteCoalescer
+from pico_ice.diagnostics import BusDiagnostics
+from pico_ice.filters import Deadband, IfNot, OnChange, RateLimit, Shadow  # noqa: F401
+from pico_ice.mux import BusMultiplexer
+from pico_ice.registers import VOLATILE
+from pico_ice.regmap import RegisterMap
+from pico_ice.worker import BusWorker
+
+
+DEFAULT_PORT = '/dev/ttyACM1'
+
+
+def split_addr(addr):
+    """Return the (device, addr) of an address, the device None by default."""
+    if isinstance(addr, tuple):
+        return addr
+    return None, addr
+
+
+class Periodic:
+    """
+    Trigger polling a register every `period` seconds.
+
+    The value read is only published if accepted by all the `filters`.
+    """
+
+    def __init__(self, period, *filters):
+        self.period = period
+        self.filters = filters
+
+
+class OnInterrupt:
+    """
+    Trigger reading a register when the bridge reports an IRQ on `line`.
+
+    The lines go from 1 to 255: line 0 is reserved, see wishbone_serial.check_irq_line().
+    """
+
+    def __init__(self, line=None, *filters):
+        self.line = line
+        self.filters = filters
+
+
+trigger_every_10ms = Periodic(0.010)
+trigger_every_100ms = Periodic(0.100)
+trigger_every_1s = Periodic(1.0)
+trigger_on_interrupt = OnInterrupt()
+trigger_on_change = Periodic(0.100, OnChange())
+trigger_if_not_0xff = Periodic(0.100, IfNot(0xFF))
+
+
+class Publish:
+    """
+    Publish the value of the register at `addr` on the ROS2 `topic`.
+
+    With several boards, `addr` is a tuple (device, addr), with the device
+    being a key of the `ports` given to the PicoIceNode.
+
+    The value is published as a std_msgs/UInt32, or as the `msg_type` given
+    among Int32 and String. With `n`, the `n` registers from `addr` are read
+    with a single burst and published together as a UInt32MultiArray (or
+    Int32MultiArray), whose data is copied from the reply at once. `addr`
+    may also be a RegisterMap, to publish the whole block of registers.
+
+    The `filters` are checked in addition to those of the trigger, against
+    a shadow copy of the last value published for this entry, the whole
+    array of values if `n` is given.
+    """
+
+    def __init__(self, addr, topic, trigger=trigger_every_100ms, filters=(), *,
+                 n=None, msg_type=None):
+        self.device, self.addr = split_addr(addr)
+        if isinstance(self.addr, RegisterMap):
+            n = self.addr.size if n is None else n
+            self.addr = self.addr.base
+        self.n = 1 if n is None else n
+        self.block = n is not None
+        self.msg_type = msg_type or (UInt32MultiArray if self.block else UInt32)
+        self.signed = self.msg_type in (Int32, Int32MultiArray)
+        self.topic = topic
+        self.trigger = trigger
+        self.shadow = Shadow(trigger.filters + tuple(filters))
+
+    def value(self, words):
+        """Return the value to filter out of the words read for this entry."""
+        return words if self.block else words[0]
+
+    def message(self, words):
+        """Return the message holding the words read for this entry."""
+        msg = self.msg_type()
+        if self.msg_type is String:
+            msg.data = ' '.join(str(word) for word in words)
+        elif self.block:
+            msg.data = array('i', words.tobytes()) if self.signed else words
+        else:
+            msg.data = words[0] - ((words[0] & 0x80000000) << 1) if self.signed else words[0]
+        return msg
+
+
+class Subscribe:
+    """
+    Write the value received on the ROS2 `topic` to the register at `addr`.
+
+    The topic may be followed by the path of a field of `msg_type`, such as
+    '/imu.orientation.x', whose value is multiplied by `scale` and rounded to
+    the nearest integer, as RegisterMap.encode() does. Without field, the
+    data of a std_msgs/String holding the integer, or of a std_msgs/UInt32
+    or Int32, is written. `addr` may be a tuple (device, addr) like for
+    Publish.
+    """
+
+    def __init__(self, addr, topic, msg_type=String, scale=1):
+        self.device, self.addr = split_addr(addr)
+        self.topic, _, field = topic.partition('.')
+        self.field = field.split('.') if field else []
+        self.msg_type = msg_type
+        self.scale = scale
+
+    def value(self, msg):
+        if not self.field:
+            data = msg.data
+            return (int(data, 0) if isinstance(data, str) else int(data)) & 0xFFFFFFFF
+        for name in self.field:
+            msg = getattr(msg, name)
+        return round(msg * self.scale) & 0xFFFFFFFF
+
+
+class PollGroup:
+    """
+    Registers of a device triggered together, read in one batch.
+
+    Registers close to each other are read with a single burst, including
+    the ones in-between, unless reading those has side effects.
+    """
+
+    def __init__(self, bus, entries):
+        self.bus = bus
+        self.entries = entries
+        self.bursts = wishbone_serial.plan_bursts(
+            (addr for entry in entries for addr in range(entry.addr, entry.addr + entry.n)),
+            max_gap=wishbone_serial.MERGE_GAP, volatile=VOLATILE)
+        # index of the burst holding the registers of each entry, and offset in it
+        self.slices = []
+        for entry in entries:
+            for i, (start, n) in enumerate(self.bursts):
+                if start <= entry.addr < start + n:
+                    self.slices.append((entry, i, entry.addr - start))
+                    break
+
+    def submit(self):
+        """Send the reads of all registers, without waiting for the replies."""
+        b = self.bus.batch()
+        futures = [b.read_block(addr, n) for addr, n in self.bursts]
+        return b.submit(), futures
+
+    def collect(self, pending):
+        """Wait for the reads sent by submit(), return (entry, words) pairs."""
+        done, futures = pending
+        done.result()
+        bursts = [future.result() for future in futures]
+        return [(entry, bursts[i][offset:offset + entry.n]) for entry, i, offset in self.slices]
+
+
+class WriteGroup:
+    """Registers written from a same topic, to their device."""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def values(self, msg):
+        values = {}
+        for entry in self.entries:
+            values.setdefault(entry.device, {})[entry.addr] = entry.value(msg)
+        return values
+
+
+class PicoIceNode(Node):
+    """
+    Bridge between ROS2 topics and pico-ice registers.
+
+    The bridge is described by a list of Publish() and Subscribe() entries.
+
+    All the Publish() entries with the same polling period or IRQ line are
+    read in a single batch of burst reads, and all the Subscribe() entries
+    of all topics are written through a WriteCoalescer, which only sends the
+    latest value of each register, as contiguous burst writes.
+
+    IRQs are waited for by a separate thread, which reads and publishes the
+    registers of the interrupt line as soon as the bridge reports it.
+
+    With `ports`, a dict device: port, several boards are driven through a
+    BusMultiplexer, and the groups of the same period on all the devices
+    are polled at once, so that all the boards work concurrently.
+
+    The timers only queue the polls to a BusWorker, and the subscriptions
+    only record the values to write, so no callback waits for the bus, and
+    the node can be spun by a MultiThreadedExecutor. A poll still queued
+    when its timer fires again is replaced by the new one.
+
+    The topics use the `qos` profile, a depth of 10 by default, which the
+    BusWorker follows as well: it keeps as many polls queued.
+
+    The transfer statistics of every bus are published on /diagnostics.
+
+    With a single port, a bus failing with serial.SerialException is
+    released, as the device went away, and opened again by the next tick
+    or message, see reconnect().
+    """
+
+    def __init__(self, entries, *, port=DEFAULT_PORT, ports=None, qos=None):
+        super().__init__('pico_ice')
+        self.qos = QoSProfile(depth=10) if qos is None else qos
+        self.port = port
+        self.reconnect_lock = threading.Lock()
+        self.mux = None
+        if ports is None:
+            self.buses = {None: wishbone_serial.get_bus(port)}
+        else:
+            self.mux = BusMultiplexer(ports)
+            self.buses = dict(self.mux.devices)
+        self.writers = {device: WriteCoalescer(bus, on_error=self.write_failed)
+                        for device, bus in self.buses.items()}
+        self.worker = BusWorker.from_qos(self.qos)
+        self.callback_group = ReentrantCallbackGroup()
+        self.publishers_ = {}
+        self.subscriptions_ = []
+        self.groups = []
+        self.irq_threads = []
+        self.diagnostics = BusDiagnostics(self, self.buses, extra={
+            device: lambda w=writer: {'superseded_writes': w.superseded, 'write_errors': w.errors,
+                                      'dropped_polls': self.worker.superseded}
+            for device, writer in self.writers.items()})
+
+        publish = [e for e in entries if isinstance(e, Publish)]
+        for entry in publish:
+            if entry.topic not in self.publishers_:
+                self.publishers_[entry.topic] = self.create_publisher(
+                    entry.msg_type, entry.topic, self.qos)
+
+        periodic = [e for e in publish if isinstance(e.trigger, Periodic)]
+        periodic.sort(key=lambda e: e.trigger.period)
+        for period, same_period in itertools.groupby(periodic, lambda e: e.trigger.period):
+            groups = [PollGroup(self.buses[device], list(group)) for device, group
+                      in itertools.groupby(sorted(same_period, key=device_key), device_key)]
+            self.create_timer(period, lambda p=period, groups=groups: self.tick(p, groups),
+                              callback_group=self.callback_group)
+            self.groups += groups
+
+        interrupt = [e for e in publish if isinstance(e.trigger, OnInterrupt)]
+        interrupt.sort(key=lambda e: (device_key(e), str(e.trigger.line)))
+        for (device, line), group in itertools.groupby(
+                interrupt, lambda e: (e.device, e.trigger.line)):
+            group = PollGroup(self.buses[device], list(group))
+            group.bus.on_irq(line, lambda _, group=group: self.poll([group]))
+            self.groups.append(group)
+
+        for device in sorted({e.device for e in interrupt}, key=str):
+            thread = threading.Thread(target=self.irq_loop, args=(device,), daemon=True)
+            thread.start()
+            self.irq_threads.append(thread)
+
+        subscribe = [e for e in entries if isinstance(e, Subscribe)]
+        subscribe.sort(key=lambda e: (e.topic, e.msg_type.__name__))
+        for (topic, _), group in itertools.groupby(
+                subscribe, lambda e: (e.topic, e.msg_type.__name__)):
+            group = WriteGroup(list(group))
+            self.subscriptions_.append(self.create_subscription(
+                group.entries[0].msg_type, topic,
+                lambda msg, group=group: self.receive(group, msg), self.qos,
+                callback_group=self.callback_group))
+
+    def destroy_node(self):
+        self.worker.close()
+        for writer in self.writers.values():
+            writer.close()
+        if self.mux is not None:
+            self.mux.close()
+        return super().destroy_node()
+
+    def irq_loop(self, device):
+        while rclpy.ok():
+            try:
+                # the bus of the device may have been replaced by reconnect()
+                self.buses[device].poll_irq(timeout=0.1)
+            except Exception as e:
+                # keep serving the IRQs: the next reads may succeed
+                self.get_logger().error(f'IRQ poll failed: {e}', throttle_duration_sec=1.0)
+                self.bus_failed(e)
+                time.sleep(0.1)
+
+    def bus_failed(self, e):
+        """Release the bus of a single port if `e` means the device went away."""
+        if self.mux is None and isinstance(e, serial.SerialException):
+            # opened again on the next tick or message
+            wishbone_serial.release_bus(self.port)
+
+    def reconnect(self):
+        """
+        Open the bus of a single port again if it was released.
+
+        The new bus keeps the statistics and the IRQ handlers of the old one,
+        and replaces it in the poll groups and the writer. Return whether the
+        bus is open.
+        """
+        if self.mux is not None:
+            return True
+        with self.reconnect_lock:
+            old = self.buses[None]
+            if old.is_open:
+                return True
+            try:
+                bus = wishbone_serial.get_bus(self.port)
+            except serial.SerialException as e:
+                self.get_logger().error(f'cannot reopen {self.port}: {e}',
+                                        throttle_duration_sec=1.0)
+                return False
+            bus.stats = old.stats
+            for line, handlers in old.irq_handlers.items():
+                for handler in handlers:
+                    bus.on_irq(line, handler)
+            # the diagnostics share this dict
+            self.buses[None] = bus
+            self.writers[None].bus = bus
+            for group in self.groups:
+                group.bus = bus
+            return True
+
+    def write_failed(self, e):
+        # the values are written again, unless newer ones come first
+        self.get_logger().error(f'write failed: {e}', throttle_duration_sec=1.0)
+        self.bus_failed(e)
+
+    def receive(self, group, msg):
+        # written by the flusher once the bus is back, if it is not
+        self.reconnect()
+        for device, values in group.values(msg).items():
+            self.writers[device].write_many(values)
+
+    def tick(self, period, groups):
+        if not self.reconnect():
+            return
+        # replaces the poll of the previous tick if the worker did not start it yet
+        self.worker.submit(self.poll, groups, key=period, callback=self.poll_done)
+
+    def poll_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.get_logger().error(f'poll failed: {future.exception()}')
+            self.bus_failed(future.exception())
+
+    def poll(self, groups):
+        pending = [group.submit() for group in groups]
+        logger = self.get_logger()
+        debug = logger.is_enabled_for(LoggingSeverity.DEBUG)
+        for group, p in zip(groups, pending):
+            now = time.monotonic()
+            for entry, words in group.collect(p):
+                if not entry.shadow.update(entry.value(words), now):
+                    continue
+                self.publishers_[entry.topic].publish(entry.message(words))
+                if debug:
+                    logger.debug(f'{entry.topic}: {list(words)}')
+
+
+def device_key(entry):
+    return str(entry.device)
+
+
+def run(entries, *, port=DEFAULT_PORT, ports=None, qos=None, args=None):
+    """Start a PicoIceNode for these entries, and spin it until shutdown."""
+    rclpy.init(args=args)
+    node = PicoIceNode(entries, port=port, ports=ports, qos=qos)
+    executor = MultiThreadedExecutor()
+    executor.add_node(node)
+    try:
+        executor.spin()
+    finally:
+        node.destroy_node()
+        rclpy.shutdown()
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from pico_ice.wishbone_serial import WishboneAckError, WishboneTimeout
+
+
+# histogram buckets are powers of two of nanoseconds, as many as bit_length()
+# can return for a perf_counter_ns() difference, so it needs no clamping
+BUCKETS = 64
+
+
+class OpStats:
+    """Count and latency histogram of one type of operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.histogram = [0] * BUCKETS
+
+    def percentile(self, p):
+        """Return an upper bound of the `p`th percentile latency, in seconds."""
+        rank = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= rank:
+                return (1 << bucket) * 1e-9
+        return 0.0
+
+    def maximum(self):
+        """Return an upper bound of the maximum latency, in seconds."""
+        for bucket in range(BUCKETS - 1, -1, -1):
+            if self.histogram[bucket]:
+                return (1 << bucket) * 1e-9
+        return 0.0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'max_s': self.maximum(),
+            'p50_s': self.percentile(50),
+            'p99_s': self.percentile(99),
+        }
+
+
+class BusStats:
+    """
+    Counters of the transfers done on a bus, enabled with bus.stats = BusStats().
+
+    Each operation type gets a count and a latency histogram with buckets in
+    powers of two, which only costs a few integer updates per operation.
+    When the bus has no stats, nothing at all is measured.
+
+    record() takes no lock: a transport only calls it from one thread at a
+    time, under its bus lock or from its I/O thread. The rarer errors,
+    retries and resyncs may come from any thread and are counted under
+    `lock`.
+    """
+
+    def __init__(self):
+        self.ops = {'read': OpStats(), 'write': OpStats(), 'rmw': OpStats(),
+                    'batch': OpStats()}
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bad_acks = 0
+        self.retries = 0
+        self.resyncs = 0
+        self.since = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, op, tx, rx, ns):
+        s = self.ops[op]
+        s.count += 1
+        s.histogram[ns.bit_length()] += 1
+        self.tx_bytes += tx
+        self.rx_bytes += rx
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors += 1
+            if isinstance(error, WishboneTimeout):
+                self.timeouts += 1
+            elif isinstance(error, WishboneAckError):
+                self.bad_acks += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_resync(self):
+        with self.lock:
+            self.resyncs += 1
+
+    def snapshot(self):
+        """Return a copy of all counters, as a dict."""
+        elapsed = time.monotonic() - self.since
+        return {
+            'elapsed_s': elapsed,
+            'tx_bytes': self.tx_bytes,
+            'rx_bytes': self.rx_bytes,
+            'tx_bytes_per_s': self.tx_bytes / elapsed if elapsed else 0.0,
+            'rx_bytes_per_s': self.rx_bytes / elapsed if elapsed else 0.0,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'bad_acks': self.bad_acks,
+            'retries': self.retries,
+            'resyncs': self.resyncs,
+            'ops': {op: s.snapshot() for op, s in self.ops.items()},
+        }
@@ -13,13 +13,18 @@
 # limitations under the License.
 
 import rclpy
+from rclpy.executors import MultiThreadedExecutor
 from rclpy.node import Node
 from rclpy.qos import QoSProfile, ReliabilityPolicy, DurabilityPolicy
 from sensor_msgs.msg import Imu
+import serial
 
 from pico_ice import wishbone_serial
+from pico_ice.coalescer import WriteCoalescer
+from pico_ice.registers import IMU
 
 
+# default of the `port` parameter, either a serial port or unix:PATH of a daemon
 tty = '/dev/ttyACM1'
 
 
@@ -27,6 +32,7 @@ class PicoIceSubscriber(Node):
 
     def __init__(self):
         super().__init__('pico_ice_subscriber')
+        self.declare_parameter('port', tty)
         qos = QoSProfile(
             depth=10,
             durability=DurabilityPolicy.SYSTEM_DEFAULT,
@@ -35,17 +41,46 @@ class PicoIceSubscriber(Node):
         self.subscription = self.create_subscription(
             Imu, '/imu', self.listener_callback, qos)
         self.subscription  # prevent unused variable warning
+        self.port = self.get_parameter('port').value
+        self.writer = WriteCoalescer(wishbone_serial.get_bus(self.port),
+                                     on_error=self.write_failed)
+
+    def write_failed(self, e):
+        # the values are written again, unless newer ones come first
+        self.get_logger().error(f'write failed: {e}', throttle_duration_sec=1.0)
+        if isinstance(e, serial.SerialException):
+            # the device went away: open it again on the next message
+            wishbone_serial.release_bus(self.port)
+
+    def reconnect(self):
+        if self.writer.bus.is_open:
+            return
+        try:
+            self.writer.bus = wishbone_serial.get_bus(self.port)
+        except serial.SerialException as e:
+            self.get_logger().error(f'cannot reopen {self.port}: {e}',
+                                    throttle_duration_sec=1.0)
 
     def listener_callback(self, imu):
-        self.get_logger().info(f'({imu.orientation.x},{imu.orientation.z},{imu.orientation.z})')
-        wishbone_serial.write(tty, 0x1000, 1000 * int(imu.orientation.x))
-        wishbone_serial.write(tty, 0x1001, 1000 * int(imu.orientation.y))
-        wishbone_serial.write(tty, 0x1002, 1000 * int(imu.orientation.z))
+        self.get_logger().info(
+            f'({imu.orientation.x},{imu.orientation.y},{imu.orientation.z})',
+            throttle_duration_sec=1.0)
+        # written by the flusher once the bus is back, if it is not
+        self.reconnect()
+        # only the latest orientation is sent if the bus is lagging behind
+        self.writer.write_many(IMU.encode_dict({
+            'x': imu.orientation.x,
+            'y': imu.orientation.y,
+            'z': imu.orientation.z,
+        }))
 
 def main(args=None):
     rclpy.init(args=args)
     pico_ice_subscriber = PicoIceSubscriber()
-    rclpy.spin(pico_ice_subscriber)
+    executor = MultiThreadedExecutor()
+    executor.add_node(pico_ice_subscriber)
+    executor.spin()
+    pico_ice_subscriber.writer.close()
     rclpy.shutdown()
 
 
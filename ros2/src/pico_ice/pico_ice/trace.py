@@ -0,0 +1,303 @@
+import argparse
+import mmap
+import statistics
+import struct
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.wishbone_serial import WishboneBus, WishboneError
+
+
+# magic, version, record size, wall clock time of the start in nanoseconds
+_FILE_HEADER = struct.Struct('<4sHHQ')
+MAGIC = b'PIWT'
+VERSION = 1
+
+# nanoseconds since the start, kind, length of the data in this record
+_RECORD = struct.Struct('<QBB2x')
+RECORD_SIZE = 64
+PAYLOAD = RECORD_SIZE - _RECORD.size
+
+TX = 0
+RX = 1
+IRQ = 2
+# set on the records continuing the data of the previous one
+CONTINUED = 0x80
+KIND_MASK = 0x7F
+
+KIND_NAMES = {TX: 'tx', RX: 'rx', IRQ: 'irq'}
+
+
+class TraceWriter:
+    """
+    Log of the bytes sent to and received from a bridge, with timestamps.
+
+    Every record is RECORD_SIZE bytes long, which allows to index the log
+    directly, and to map it as an array. Data longer than one record is
+    split over several, all but the first marked as CONTINUED.
+
+        bus.trace = TraceWriter('/tmp/wishbone.trace')
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(_FILE_HEADER.pack(MAGIC, VERSION, RECORD_SIZE, time.time_ns()))
+        self.start = time.monotonic_ns()
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, kind, data):
+        """Append `data` of `kind` TX, RX or IRQ with the current time."""
+        t = time.monotonic_ns() - self.start
+        n = max(1, -(-len(data) // PAYLOAD))
+        buffer = bytearray(n * RECORD_SIZE)
+        for i in range(n):
+            chunk = data[i * PAYLOAD:(i + 1) * PAYLOAD]
+            _RECORD.pack_into(buffer, i * RECORD_SIZE, t, kind | (CONTINUED if i else 0),
+                              len(chunk))
+            start = i * RECORD_SIZE + _RECORD.size
+            buffer[start:start + len(chunk)] = chunk
+        with self.lock:
+            self.file.write(buffer)
+            self.records += n
+
+    def tx(self, data):
+        self.record(TX, data)
+
+    def rx(self, data):
+        self.record(RX, data)
+
+    def irq(self, data):
+        self.record(IRQ, data)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class TraceReader:
+    """
+    Memory-mapped trace written by a TraceWriter.
+
+    The records are only read from the file as they are accessed, so that
+    traces of millions of frames can be analyzed without loading them.
+    With NumPy, `records` is a structured array over the mapped file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.wall_start = _FILE_HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f'{path}: not a wishbone trace, or of an unsupported version')
+        self.count = (len(self.map) - _FILE_HEADER.size) // RECORD_SIZE
+
+        self.records = None
+        if numpy is not None:
+            self.records = numpy.ndarray((self.count,), dtype=numpy.dtype([
+                ('t', '<u8'), ('kind', 'u1'), ('length', 'u1'), ('pad', 'V2'),
+                ('data', 'u1', PAYLOAD),
+            ]), buffer=self.map, offset=_FILE_HEADER.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # the array must go before the map it points to
+        self.records = None
+        self.map.close()
+
+    def __iter__(self):
+        """Yield every record as a (t_ns, kind, data) tuple."""
+        for pos in range(_FILE_HEADER.size, _FILE_HEADER.size + self.count * RECORD_SIZE,
+                         RECORD_SIZE):
+            t, kind, length = _RECORD.unpack_from(self.map, pos)
+            start = pos + _RECORD.size
+            yield t, kind, self.map[start:start + length]
+
+    def chunks(self):
+        """Yield the (t_ns, kind, data) as recorded, joining CONTINUED records."""
+        current = None
+        for t, kind, data in self:
+            if kind & CONTINUED and current is not None:
+                current[2].extend(data)
+                continue
+            if current is not None:
+                yield current[0], current[1], bytes(current[2])
+            current = (t, kind & KIND_MASK, bytearray(data))
+        if current is not None:
+            yield current[0], current[1], bytes(current[2])
+
+    def stats(self):
+        """
+        Return the throughput and the latency of the transfers of the trace.
+
+        The bytes and chunks of each kind are counted, and the latency goes
+        from the start of a TX to the end of the RX. The percentiles are
+        interpolated linearly, with or without NumPy.
+        """
+        if self.records is not None:
+            t = self.records['t']
+            kind = self.records['kind']
+            length = self.records['length']
+            first = kind & CONTINUED == 0
+            totals = {name: (int(numpy.count_nonzero(first & (kind & KIND_MASK == k))),
+                             int(length[kind & KIND_MASK == k].sum(dtype='u8')))
+                      for k, name in KIND_NAMES.items()}
+            tx_t = t[kind == TX]
+            rx_t = t[kind == RX]
+            i = numpy.searchsorted(tx_t, rx_t, 'right') - 1
+            latencies = (rx_t[i >= 0] - tx_t[i[i >= 0]]).astype('f8')
+            duration = int(t[-1] - t[0]) if self.count else 0
+            percentiles = (numpy.percentile(latencies, [50, 99], method='linear')
+                           if len(latencies) else [0.0, 0.0])
+            max_latency = float(latencies.max()) if len(latencies) else 0.0
+        else:
+            totals = {name: [0, 0] for name in KIND_NAMES.values()}
+            latencies = []
+            last_tx = None
+            t0 = t = None
+            for t, kind, data in self:
+                t0 = t if t0 is None else t0
+                name = KIND_NAMES.get(kind & KIND_MASK)
+                if name is None:
+                    continue
+                totals[name][1] += len(data)
+                if kind & CONTINUED:
+                    continue
+                totals[name][0] += 1
+                if kind == TX:
+                    last_tx = t
+                elif kind == RX and last_tx is not None:
+                    latencies.append(t - last_tx)
+            duration = t - t0 if self.count else 0
+            if len(latencies) > 1:
+                # the same interpolation as numpy.percentile()
+                centiles = statistics.quantiles(latencies, n=100, method='inclusive')
+                percentiles = [centiles[49], centiles[98]]
+            else:
+                percentiles = latencies * 2 or [0.0, 0.0]
+            max_latency = max(latencies, default=0.0)
+
+        seconds = duration * 1e-9
+        stats = {'records': self.count, 'duration_s': seconds, 'transfers': len(latencies),
+                 'latency_p50_s': percentiles[0] * 1e-9, 'latency_p99_s': percentiles[1] * 1e-9,
+                 'latency_max_s': max_latency * 1e-9}
+        for name, (chunks, size) in totals.items():
+            stats[f'{name}_chunks'] = chunks
+            stats[f'{name}_bytes'] = size
+            stats[f'{name}_bytes_per_s'] = size / seconds if seconds else 0.0
+        return stats
+
+
+def replay(reader, bus, *, realtime=False):
+    """
+    Send the TX data of a trace to `bus` again, and compare the replies.
+
+    Each TX chunk is sent as a transfer expecting as many bytes of reply as
+    the RX chunks that followed it in the trace. With `realtime`, the delays
+    between the transfers are kept as recorded. Return the number of
+    transfers, of replies differing from the trace, and of errors.
+    """
+    transfers = mismatches = errors = 0
+    start = time.monotonic_ns()
+    pending = None
+
+    def send(t, frames, expected):
+        nonlocal transfers, mismatches, errors
+        if realtime:
+            delay = t - (time.monotonic_ns() - start)
+            if delay > 0:
+                time.sleep(delay * 1e-9)
+        transfers += 1
+        try:
+            if bus._transfer(frames, len(expected), 'batch', 0) != expected:
+                mismatches += 1
+        except WishboneError:
+            errors += 1
+
+    t0 = None
+    for t, kind, data in reader.chunks():
+        t0 = t if t0 is None else t0
+        if kind == TX:
+            if pending is not None:
+                send(*pending)
+            pending = (t - t0, data, b'')
+        elif kind == RX and pending is not None:
+            pending = (pending[0], pending[1], pending[2] + data)
+    if pending is not None:
+        send(*pending)
+    return {'transfers': transfers, 'mismatches': mismatches, 'errors': errors}
+
+
+def report(stats):
+    for key, value in stats.items():
+        print(f'{key:20} {value:.6g}' if isinstance(value, float) else f'{key:20} {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='inspect and replay wire traces of the wishbone bridge')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('stats', help='print the throughput and latency of a trace')
+    p.add_argument('trace')
+    p = sub.add_parser('dump', help='print the records of a trace')
+    p.add_argument('trace')
+    p = sub.add_parser('replay', help='send the frames of a trace again')
+    p.add_argument('trace')
+    p.add_argument('--serial', dest='serial', default=None,
+                   help='serial port of a bridge, or replay against an emulator if absent')
+    p.add_argument('--realtime', action='store_true',
+                   help='keep the delays between the transfers as recorded')
+    p.add_argument('--record', default=None,
+                   help='trace the replay itself to this file')
+    args = parser.parse_args()
+
+    with TraceReader(args.trace) as reader:
+        if args.command == 'stats':
+            report(reader.stats())
+        elif args.command == 'dump':
+            for t, kind, data in reader.chunks():
+                print(f'{t * 1e-9:12.6f} {KIND_NAMES.get(kind, kind):3} {data.hex()}')
+        elif args.command == 'replay':
+            emu = None
+            port = args.serial
+            if port is None:
+                emu = BridgeEmulator()
+                port = emu.port
+            try:
+                with WishboneBus(port) as bus:
+                    if args.record is not None:
+                        bus.trace = TraceWriter(args.record)
+                    report(replay(reader, bus, realtime=args.realtime))
+                    if bus.trace is not None:
+                        bus.trace.close()
+            finally:
+                if emu is not None:
+                    emu.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import asyncio
+from collections import deque
+import inspect
+import os
+import time
+
+import serial
+
+from pico_ice.wishbone_serial import (
+    CAS, check_irq_line, DEFAULT_TIMEOUT, encode_read, encode_rmw, encode_write, MASKED,
+    OP_READ, OP_READ_WORD, OP_RMW, OP_WRITE, open_port, ReplyQueue, Resync, WishboneError,
+    WishboneTimeout)
+
+
+class AsyncWishboneBus:
+    """
+    Connection to a Wishbone-serial bridge for use from an asyncio event loop.
+
+    A reader registered on the event loop parses the replies as they come,
+    and hands them to the transfers awaiting them in a FIFO, so that any
+    number of coroutines can access the bus concurrently without threads:
+    their frames are sent as soon as they are issued, and the bridge
+    answers them in order. Bytes received while no transfer is pending are
+    IRQ bytes, dispatched to the handlers registered with on_irq().
+
+    The frames are written by a writer registered on the event loop as the
+    port accepts them, so that a large write_block() never blocks the loop.
+
+    When no reply comes for `timeout` seconds while some are pending, they
+    fail with WishboneTimeout, and the stream is resynchronized before the
+    next transfers are sent. So is it when a reply fails its ACK check,
+    failing the replies after it.
+
+        bus = AsyncWishboneBus('/dev/ttyACM1')
+        x, y = await asyncio.gather(bus.read(0x1000), bus.read(0x1001))
+    """
+
+    def __init__(self, port, *, timeout=DEFAULT_TIMEOUT):
+        self.port = port
+        self.timeout = timeout
+        self.loop = asyncio.get_running_loop()
+        # non-blocking reads and writes, both driven by the event loop
+        self.serial = open_port(port, timeout=0)
+        self.fd = self.serial.fileno()
+        os.set_blocking(self.fd, False)
+        self.replies = ReplyQueue(on_irq=self._dispatch_irq)
+        self.out = bytearray()
+        self.irq_handlers = {}
+        self.deadline = None
+        self.timer = None
+        self.resync = None
+        self.held = deque()
+        self.loop.add_reader(self.fd, self._reader)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self.serial.is_open
+
+    def close(self):
+        if self.serial.is_open:
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+            self.serial.close()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.out.clear()
+        self.resync = None
+        self._fail_held(WishboneError('connection closed'))
+        self.replies.fail(WishboneError('connection closed'))
+
+    def on_irq(self, line, handler):
+        """
+        Call `handler(line)` for each IRQ on `line`, or on any line if None.
+
+        Coroutine functions are scheduled as a new task for each IRQ.
+        """
+        check_irq_line(line)
+        self.irq_handlers.setdefault(line, []).append(handler)
+
+    def _dispatch_irq(self, line):
+        for handler in self.irq_handlers.get(line, []) + self.irq_handlers.get(None, []):
+            if inspect.iscoroutinefunction(handler):
+                self.loop.create_task(handler(line))
+            else:
+                handler(line)
+
+    def _reader(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except serial.SerialException as e:
+            self._fail(e)
+            return
+        if self.resync is not None:
+            self.resync.feed(data)
+            # the resync may move on sooner than its timer
+            if self.timer is not None:
+                self.timer.cancel()
+            self._check_timeout()
+            return
+        error = self.replies.feed(data)
+        if error is not None:
+            self._resync(error)
+            return
+        self.deadline = time.monotonic() + self.timeout
+
+    def _writer(self):
+        try:
+            n = os.write(self.fd, self.out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(serial.SerialException(f'write failed: {e}'))
+            return
+        del self.out[:n]
+        if n:
+            self.deadline = time.monotonic() + self.timeout
+        if not self.out:
+            self.loop.remove_writer(self.fd)
+
+    def _fail(self, error):
+        # the transfers get the error itself, before close() fails them otherwise
+        self.replies.fail(error)
+        self._fail_held(error)
+        self.close()
+
+    def _send(self, data):
+        if not self.out:
+            self.loop.add_writer(self.fd, self._writer)
+        self.out += data
+
+    def _fail_held(self, error):
+        while self.held:
+            _, _, _, future = self.held.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def _watch(self, delay):
+        if self.timer is None:
+            self.timer = self.loop.call_later(delay, self._check_timeout)
+
+    def _check_timeout(self):
+        """
+        Time out the late replies, and drive the resync.
+
+        The replies late by more than `timeout` fail, and the stream is
+        resynchronized before the held transfers are sent.
+        """
+        self.timer = None
+        if self.resync is None:
+            if not self.replies:
+                return
+            left = self.deadline - time.monotonic()
+            if left > 0:
+                self._watch(left)
+                return
+            self._resync(WishboneTimeout(f'{self.port}: no reply for {self.timeout} s'))
+            return
+
+        left = self.resync.poll()
+        if self.resync.output:
+            self._send(self.resync.output)
+            self.resync.output.clear()
+        if self.resync.error is not None:
+            self._fail_held(self.resync.error)
+        if self.resync.done or self.resync.error is not None:
+            self.resync = None
+            while self.held:
+                self._push(*self.held.popleft())
+        else:
+            self._watch(left)
+
+    def _resync(self, error):
+        """Fail the pending replies with `error`, and resynchronize."""
+        self.replies.fail(error)
+        # the rest of the frames are sent once the stream is aligned again
+        self.out.clear()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.resync = Resync(self.port)
+        self._check_timeout()
+
+    def _push(self, kind, frames, size, future):
+        if not self.replies:
+            self.deadline = time.monotonic() + self.timeout
+        self.replies.push(kind, size, future)
+        if size == 0:
+            self.replies.feed(b'')
+        else:
+            self._send(frames)
+            self._watch(self.timeout)
+
+    def _submit(self, kind, frames, size):
+        if not self.serial.is_open:
+            raise WishboneError('connection closed')
+        future = self.loop.create_future()
+        if self.resync is not None:
+            # sent once the stream is aligned again
+            self.held.append((kind, frames, size, future))
+        else:
+            self._push(kind, frames, size, future)
+        return future
+
+    async def read_block(self, addr, n):
+        frames = bytearray()
+        size = encode_read(frames, addr, n)
+        return await self._submit(OP_READ, frames, size)
+
+    async def write_block(self, addr, words):
+        frames = bytearray()
+        size = encode_write(frames, addr, words)
+        await self._submit(OP_WRITE, frames, size)
+
+    async def read(self, addr):
+        frames = bytearray()
+        size = encode_read(frames, addr, 1)
+        return await self._submit(OP_READ_WORD, frames, size)
+
+    async def write(self, addr, data):
+        await self.write_block(addr, (data,))
+
+    async def masked_write(self, addr, mask, value):
+        return await self._rmw(MASKED, addr, mask, value)
+
+    async def set_bits(self, addr, bits):
+        return await self._rmw(MASKED, addr, bits, bits)
+
+    async def clear_bits(self, addr, bits):
+        return await self._rmw(MASKED, addr, bits, 0)
+
+    async def compare_and_swap(self, addr, expected, value):
+        return await self._rmw(CAS, addr, expected, value)
+
+    async def _rmw(self, op, addr, a, b):
+        frames = bytearray()
+        size = encode_rmw(frames, op, addr, a, b)
+        return await self._submit(OP_RMW, frames, size)
@@ -1,40 +1,1022 @@
 import argparse
-import serial
+from array import array
+import atexit
+from collections import deque
+from concurrent.futures import Future
+import fcntl
+import io
+import mmap
+import os
+import select
+import socket
 import struct
+import sys
+import termios
+import threading
+import time
+import zlib
+
+import serial
+
+
+CMD_WRITE = 0x00
+CMD_READ = 0x01
+ACK = 0x00
+
+# maximum value of the length field, in bytes
+MAX_LENGTH = 0x55
+MAX_WORDS = MAX_LENGTH // 4
+
+# address flag to access the same register for every word of a frame, such
+# as a FIFO, instead of incrementing addresses
+FIFO = 0x80000000
+
+# address flags of a write of two words executed by the bridge as a single
+# operation on the register: (mask, value) replaces the bits set in mask,
+# and (expected, value) writes value only if the register holds expected;
+# a read at RESULT then returns the resulting value, or the value found by
+# the compare-and-swap
+MASKED = 0x20000000
+CAS = 0x40000000
+RESULT = MASKED | CAS
+
+# seconds to wait for a reply, and number of retries of idempotent transfers
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_RETRIES = 2
+
+# seconds to wait for more bytes after a reply, seconds of silence after which
+# the bridge is taken as idle while resynchronizing, and number of attempts
+RESYNC_QUIET = 0.01
+RESYNC_TIMEOUT = 0.1
+RESYNC_ATTEMPTS = 3
+
+# prefix of the ports that are the socket of a BridgeDaemon
+UNIX_PREFIX = 'unix:'
+
+# number of unused registers worth reading to save a frame header (6 bytes)
+# and a separate read in the batch, for the callers of plan_bursts() opting in
+MERGE_GAP = 4
+
+# command, length, address
+_HEADER = struct.Struct('>BBI')
+_WORD = struct.Struct('>I')
+# write of 0 bytes, only answered by an ACK
+_NOP = _HEADER.pack(CMD_WRITE, 0, 0)
+_ZERO = bytes([ACK])
+# zeros completing any partial frame sent by the host, made of whole NOPs so
+# that a daemon parsing the frames does not see a partial one in turn
+_PADDING = bytes(-(-(_HEADER.size + MAX_LENGTH) // _HEADER.size) * _HEADER.size)
+
+assert array('I').itemsize == 4
 
 
 class WishboneError(Exception):
     pass
 
 
-def xfer(port, addr, data):
-    s = serial.Serial(port)
+class WishboneAckError(WishboneError):
+    pass
 
-    if data is None:
-        # Read command
-        s.write(b'\x01')
-    else:
-        # Write command
-        s.write(b'\x00')
 
-    # TODO: support buffer up to 0x55 bytes
-    s.write(b'\x04')
-    s.write(struct.pack('>I', addr))
+class WishboneTimeout(WishboneError):
+    pass
+
+
+class BaseBus:
+    """
+    Register accesses common to all the transports of the bridge protocol.
+
+    Subclasses provide _transfer(), sending frames and returning the reply,
+    and may override _submit() to send frames without waiting for the reply.
+
+    Setting `stats` to a pico_ice.stats.BusStats() enables the measurement
+    of all operations, done by the transports around the I/O itself, so that
+    their fastest paths are kept.
+    """
+
+    stats = None
+    # TraceWriter recording the bytes on the wire, if any
+    trace = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def on_irq(self, line, handler):
+        """Call `handler(line)` for each IRQ on `line`, or on any line if None."""
+        check_irq_line(line)
+        self.irq_handlers.setdefault(line, []).append(handler)
+
+    def _dispatch_irq(self, line):
+        for handler in self.irq_handlers.get(line, []) + self.irq_handlers.get(None, []):
+            handler(line)
+
+    def _transfer(self, frames, size, op='batch', acks=None):
+        """
+        Send `frames` at once and return the `size` bytes of reply.
+
+        The first `acks` bytes of the reply must be ACKs, or if None, the
+        replies to the writes found in `frames`. The transfer is recorded to
+        the stats as an `op`.
+        """
+        raise NotImplementedError
+
+    def _submit(self, frames, size, op='batch'):
+        """Send `frames` and return a Future of the `size` bytes of reply."""
+        future = Future()
+        try:
+            future.set_result(self._transfer(frames, size, op))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def read_block(self, addr, n):
+        """Read `n` consecutive registers starting at `addr` into an array."""
+        frames = bytearray()
+        size = encode_read(frames, addr, n)
+        reply = self._transfer(frames, size, 'read', 0)
+        words = array('I')
+        words.frombytes(reply)
+        return from_wire(words)
+
+    def write_block(self, addr, words):
+        """
+        Write consecutive registers starting at `addr`.
+
+        `words` is either a sequence of integers (such as array('I')), or a
+        bytes-like object already holding big-endian 32-bit words.
+        """
+        frames = bytearray()
+        size = encode_write(frames, addr, words)
+        self._transfer(frames, size, 'write', size)
+
+    def read_fifo(self, addr, n):
+        """Read `n` words from the same register at `addr`, such as a FIFO."""
+        return self.read_block(addr | FIFO, n)
+
+    def stream(self, addr, n=MAX_WORDS, *, count_addr=None, empty=None, interval=0.01):
+        """
+        Drain the FIFO at `addr` continuously, yielding arrays of words.
+
+        With `count_addr`, the register there holds the number of words in
+        the FIFO, which is read first, and then up to `n` words. Otherwise,
+        `n` words are read every time, and those equal to `empty` dropped.
+        When the FIFO is empty, wait `interval` seconds before trying again.
+
+        Nothing is read until the next array is asked for, so a slow consumer
+        lets the words pile up in the FIFO instead of in the host memory.
+
+            for words in bus.stream(0x3000, count_addr=0x3001):
+                for word in words:
+                    ...
+        """
+        while True:
+            if count_addr is None:
+                words = self.read_fifo(addr, n)
+                if empty is not None and empty in words:
+                    words = array('I', (word for word in words if word != empty))
+            else:
+                count = min(self.read(count_addr), n)
+                words = self.read_fifo(addr, count) if count else None
+            if words:
+                yield words
+            else:
+                time.sleep(interval)
+
+    def masked_write(self, addr, mask, value):
+        """Replace the bits of `mask` by those of `value`, return the new value."""
+        return self._rmw(MASKED, addr, mask, value)
+
+    def set_bits(self, addr, bits):
+        """Set the `bits` of a register, return its new value."""
+        return self._rmw(MASKED, addr, bits, bits)
+
+    def clear_bits(self, addr, bits):
+        """Clear the `bits` of a register, return its new value."""
+        return self._rmw(MASKED, addr, bits, 0)
+
+    def compare_and_swap(self, addr, expected, value):
+        """
+        Write `value` only if the register holds `expected`.
+
+        Return the value the register held: the swap happened if it is
+        `expected`.
+        """
+        return self._rmw(CAS, addr, expected, value)
+
+    def _rmw(self, op, addr, a, b):
+        """
+        Do the operation `op` on a register, and read its result back.
+
+        Both are sent in the same round trip, without any other transfer
+        in-between.
+        """
+        frames = bytearray()
+        size = encode_rmw(frames, op, addr, a, b)
+        reply = self._transfer(frames, size, 'rmw', 1)
+        return _WORD.unpack_from(reply, 1)[0]
+
+    def batch(self):
+        """Return a Batch queuing transfers to send in a single round trip."""
+        return Batch(self)
+
+    def xfer(self, addr, data):
+        if data is None:
+            return self.read(addr)
+        self.write(addr, data)
+        return None
+
+    def read(self, addr):
+        return self.read_block(addr, 1)[0]
+
+    def write(self, addr, data):
+        self.write_block(addr, (data,))
+
+
+class SocketPort:
+    """
+    Connection to a BridgeDaemon of pico_ice.daemon, through its Unix socket.
+
+    It offers the part of the serial.Serial interface used by the buses, so
+    that `unix:PATH` can be given wherever a serial port is expected.
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except OSError as e:
+            self.sock.close()
+            raise serial.SerialException(f'could not connect to {path}: {e}')
+        self.sock.setblocking(False)
+
+    @property
+    def is_open(self):
+        return self.sock.fileno() >= 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('I', fcntl.ioctl(self.sock, termios.FIONREAD, bytes(4)))[0]
+
+    def read(self, size=1):
+        """Read up to `size` bytes, waiting up to `timeout` seconds for them."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self.sock], [], [], left)[0]:
+                break
+            try:
+                chunk = self.sock.recv(size - len(data))
+            except BlockingIOError:
+                continue
+            if not chunk:
+                raise serial.SerialException(f'{self.path}: daemon disconnected')
+            data += chunk
+        return bytes(data)
+
+    def write(self, data):
+        data = memoryview(data)
+        n = 0
+        while n < len(data):
+            try:
+                n += self.sock.send(data[n:])
+            except BlockingIOError:
+                select.select([], [self.sock], [])
+            except OSError as e:
+                raise serial.SerialException(f'write failed: {e}')
+        return n
+
+
+def open_port(port, *, timeout=None):
+    """
+    Open the serial port of a bridge, or the socket of a daemon as `unix:PATH`.
+
+    Serial ports are locked, so that a second process opening the same port
+    fails instead of mixing its frames with the ones of the first.
+    """
+    if port.startswith(UNIX_PREFIX):
+        return SocketPort(port[len(UNIX_PREFIX):], timeout)
+    return serial.Serial(port, timeout=timeout, exclusive=True)
+
+
+class WishboneBus(BaseBus):
+    """
+    Connection to a Wishbone-serial bridge, kept open across transfers.
+
+    The serial port is opened once and reused for every access, so that
+    a register read or write only costs the bytes sent on the wire.
+    A lock serializes the transfers of all threads sharing the bus.
+
+    The bridge also sends an IRQ byte, holding the number of the IRQ line,
+    when the FPGA raises an interrupt. It only does so in-between replies,
+    so any byte received while no transfer is pending is an IRQ, that is
+    dispatched by poll_irq() to the handlers registered with on_irq().
+    A 0 is a late ACK rather than an IRQ, and IRQ line 0 cannot be used.
+    An IRQ byte crossing a frame on its way to the bridge is not detected
+    before a read, see check_irq_line().
+
+    The port may also be `unix:PATH`, the socket of a BridgeDaemon sharing
+    the bridge with other processes.
+    """
+
+    def __init__(self, port, *, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        self.port = port
+        self.serial = open_port(port, timeout=timeout)
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.irq_handlers = {}
+        self.irqs = deque()
+
+        # the frames are written and the replies read in place, through the
+        # file descriptor of the port, with no intermediate copy
+        self.fd = self.serial.fileno()
+        self.fds = [self.fd]
+        self.raw = io.FileIO(self.fd, 'r+', closefd=False)
+        self.frame = bytearray(_HEADER.size + 4)
+        self.read_frame = memoryview(self.frame)[:_HEADER.size]
+        self.word = bytearray(4)
+        self.ack = bytearray(1)
+
+    @property
+    def timeout(self):
+        """Seconds to wait for the reply of a transfer, None to wait forever."""
+        return self.serial.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.serial.timeout = timeout
+
+    @property
+    def is_open(self):
+        return self.serial.is_open
+
+    def close(self):
+        with self.lock:
+            self.serial.close()
+
+    def poll_irq(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for IRQs, and dispatch them to handlers.
+
+        Return the number of IRQs dispatched. The handlers are called from
+        the calling thread, without the bus lock, so they can access the bus.
+        """
+        if not self.irqs:
+            ready, _, _ = select.select([self.serial.fileno()], [], [], timeout)
+            if ready:
+                with self.lock:
+                    self._drain_irqs()
+        n = 0
+        while self.irqs:
+            self._dispatch_irq(self.irqs.popleft())
+            n += 1
+        return n
+
+    def _drain_irqs(self):
+        """
+        Queue the IRQ bytes received while no transfer is pending.
+
+        They are dropped if there is no handler for them, so that a stray byte
+        cannot be taken as the start of the next reply.
+        """
+        waiting = self.serial.in_waiting
+        if waiting:
+            data = self.serial.read(waiting)
+            if self.trace is not None:
+                self.trace.irq(data)
+            if self.irq_handlers:
+                self.irqs.extend(line for line in data if line != ACK)
+
+    def _attempt(self, op, tx, rx, fn, *args, idempotent):
+        """
+        Call `fn(*args)` with the bus locked, resynchronizing after a failure.
+
+        A timeout or an invalid ack means that the replies and the transfers
+        are no longer aligned, so the stream is resynchronized before raising
+        the error, or before calling `fn` again up to `retries` times if the
+        transfer is `idempotent`, that is, free of writes and FIFO reads.
+
+        With stats, each call is recorded as an `op` of `tx` bytes sent and
+        `rx` bytes received, or as an error.
+        """
+        attempt = 0
+        with self.lock:
+            while True:
+                self._drain_irqs()
+                stats = self.stats
+                t0 = time.perf_counter_ns() if stats is not None else 0
+                try:
+                    result = fn(*args)
+                except (WishboneTimeout, WishboneAckError) as e:
+                    if stats is not None:
+                        stats.record_error(e)
+                    self._resync()
+                    if not idempotent or attempt >= self.retries:
+                        raise
+                else:
+                    if stats is not None:
+                        stats.record(op, tx, rx, time.perf_counter_ns() - t0)
+                    return result
+                attempt += 1
+                if self.stats is not None:
+                    self.stats.record_retry()
+
+    def _resync(self):
+        """Realign the byte stream with the bridge, without reopening the port."""
+        if self.stats is not None:
+            self.stats.record_resync()
+        resync = Resync(self.port)
+        while True:
+            timeout = resync.poll()
+            if resync.output:
+                self._write(resync.output)
+                resync.output.clear()
+            if resync.done:
+                return
+            if resync.error is not None:
+                raise resync.error
+            if select.select(self.fds, [], [], timeout)[0]:
+                resync.feed(self._read_input())
+
+    def _read_input(self):
+        """Return the bytes received, without waiting for them."""
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return b''
+        except OSError as e:
+            raise serial.SerialException(f'read failed: {e}')
+        if not data:
+            raise serial.SerialException(f'{self.port}: device disconnected')
+        if self.trace is not None:
+            self.trace.rx(data)
+        return data
+
+    def _transfer(self, frames, size, op='batch', acks=None):
+        return self._attempt(op, len(frames), size, self._exchange, frames, size, acks,
+                             idempotent=is_idempotent(frames))
+
+    def _exchange(self, frames, size, acks):
+        self._write(frames)
+        reply = bytearray(size)
+        self._read_into(reply)
+        if acks is None:
+            check_replies(frames, reply)
+        elif acks:
+            check_acks(memoryview(reply)[:acks])
+        return reply
+
+    def read(self, addr):
+        """Read one register, with the frame and reply in reused buffers."""
+        if addr & FIFO:
+            return super().read(addr)
+        return self._attempt('read', _HEADER.size, 4, self._read_word, addr, idempotent=True)
+
+    def _read_word(self, addr):
+        _HEADER.pack_into(self.frame, 0, CMD_READ, 4, addr)
+        self._write(self.read_frame)
+        self._read_into(self.word)
+        return _WORD.unpack_from(self.word)[0]
+
+    def write(self, addr, data):
+        """Write one register, with the frame and reply in reused buffers."""
+        self._attempt('write', len(self.frame), 1, self._write_word, addr, data,
+                      idempotent=False)
+
+    def _write_word(self, addr, data):
+        _HEADER.pack_into(self.frame, 0, CMD_WRITE, 4, addr)
+        _WORD.pack_into(self.frame, _HEADER.size, data)
+        self._write(self.frame)
+        self._read_into(self.ack)
+        check_acks(self.ack)
+
+    def _write(self, data):
+        """Write all of the bytes of `data`, with no copy."""
+        if self.trace is not None:
+            self.trace.tx(data)
+        n = 0
+        while n < len(data):
+            try:
+                n += os.write(self.fd, memoryview(data)[n:] if n else data)
+            except BlockingIOError:
+                select.select([], self.fds, [])
+            except OSError as e:
+                raise serial.SerialException(f'write failed: {e}')
+
+    def _read_into(self, buffer):
+        """Fill `buffer` with the reply, waiting up to the timeout of the port."""
+        timeout = self.serial.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        got = 0
+        while got < len(buffer):
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select(self.fds, [], [], left)
+            if not ready:
+                break
+            try:
+                n = self.raw.readinto(memoryview(buffer)[got:] if got else buffer)
+            except OSError as e:
+                raise serial.SerialException(f'read failed: {e}')
+            if not n:
+                # like pyserial: readable but no data means the device is gone
+                raise serial.SerialException(f'{self.port}: device disconnected')
+            got += n
+        if self.trace is not None:
+            self.trace.rx(memoryview(buffer)[:got])
+        if got != len(buffer):
+            raise WishboneTimeout(f'short read: {got} of {len(buffer)} bytes')
+
+
+class Batch:
+    """
+    Transfers queued to be sent to the bridge all at once.
+
+    All frames are sent with a single write, and the concatenated replies
+    are then read and dispatched in order to the Future returned by each
+    operation. The bridge handles frames one after the other, so this
+    costs one round trip for the whole batch instead of one per frame.
+
+        with bus.batch() as b:
+            b.write(0x1000, 1)
+            f = b.read(0x1001)
+        print(f.result())
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.frames = bytearray()
+        self.ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self.ops)
+
+    def read_block(self, addr, n):
+        future = Future()
+        self.ops.append((OP_READ, encode_read(self.frames, addr, n), future))
+        return future
+
+    def read_fifo(self, addr, n):
+        return self.read_block(addr | FIFO, n)
+
+    def write_block(self, addr, words):
+        future = Future()
+        self.ops.append((OP_WRITE, encode_write(self.frames, addr, words), future))
+        return future
+
+    def read(self, addr):
+        future = Future()
+        self.ops.append((OP_READ_WORD, encode_read(self.frames, addr, 1), future))
+        return future
 
-    if data is None:
-        # Read command
-        data = struct.unpack('>I', s.read(4))[0]
+    def write(self, addr, data):
+        return self.write_block(addr, (data,))
 
+    def masked_write(self, addr, mask, value):
+        return self._rmw(MASKED, addr, mask, value)
+
+    def set_bits(self, addr, bits):
+        return self._rmw(MASKED, addr, bits, bits)
+
+    def clear_bits(self, addr, bits):
+        return self._rmw(MASKED, addr, bits, 0)
+
+    def compare_and_swap(self, addr, expected, value):
+        return self._rmw(CAS, addr, expected, value)
+
+    def _rmw(self, op, addr, a, b):
+        future = Future()
+        self.ops.append((OP_RMW, encode_rmw(self.frames, op, addr, a, b), future))
+        return future
+
+    def submit(self):
+        """
+        Send all queued frames without waiting for the replies.
+
+        Return a Future completed once the Future of each operation is,
+        failing with the first error if any, so that the batches of several
+        buses can be in flight at the same time.
+        """
+        frames, ops = self.frames, self.ops
+        self.frames, self.ops = bytearray(), []
+        size = sum(op[1] for op in ops)
+        stats = self.bus.stats
+        done = Future()
+
+        def on_reply(reply):
+            try:
+                reply = reply.result()
+            except Exception as e:
+                for _, _, future in ops:
+                    future.set_exception(e)
+                done.set_exception(e)
+            else:
+                error = parse_replies(memoryview(reply), ops)
+                if error is not None:
+                    done.set_exception(error)
+                    # the transfer itself was recorded by the transport
+                    if stats is not None:
+                        stats.record_error(error)
+                else:
+                    done.set_result(None)
+
+        self.bus._submit(frames, size).add_done_callback(on_reply)
+        return done
+
+    def flush(self):
+        """Send all queued frames and resolve the Future of each operation."""
+        if self.ops:
+            self.submit().result()
+
+
+OP_READ = 0
+OP_READ_WORD = 1
+OP_WRITE = 2
+OP_RAW = 3
+OP_RMW = 4
+
+
+def parse_replies(reply, ops):
+    """
+    Resolve the Future of each (kind, size, future) from their replies.
+
+    Return the first error encountered, after all Futures are resolved.
+    """
+    error = None
+    pos = 0
+    for kind, size, future in ops:
+        error = resolve(kind, reply[pos:pos + size], future) or error
+        pos += size
+    return error
+
+
+def resolve(kind, reply, future, frames=None):
+    """
+    Set the result of `future` from its reply, return the error if any.
+
+    The reply of OP_RAW `frames` is checked as well, if they are given.
+    """
+    if future.done():
+        # cancelled while waiting for the reply
+        return None
+    if kind in (OP_WRITE, OP_RMW) or kind == OP_RAW and frames is not None:
+        try:
+            if kind == OP_RAW:
+                check_replies(frames, reply)
+            else:
+                check_acks(reply[:1] if kind == OP_RMW else reply)
+        except WishboneError as e:
+            future.set_exception(e)
+            return e
+    if kind in (OP_WRITE, OP_RMW):
+        future.set_result(_WORD.unpack_from(reply, 1)[0] if kind == OP_RMW else None)
+    elif kind == OP_RAW:
+        future.set_result(reply)
     else:
-        # Write command
-        s.write(struct.pack('>I', data))
-        d = s.read(1)
-        if d[0] != 0x00:
-            raise WishboneError(f"invalid ack byte received: 0x{d[0]:02x}")
-        data = None
+        words = array('I')
+        words.frombytes(reply)
+        from_wire(words)
+        future.set_result(words[0] if kind == OP_READ_WORD else words)
+    return None
+
+
+class ReplyQueue:
+    """
+    Match the byte stream coming from the bridge to the transfers awaiting it.
+
+    The bridge replies to the frames in the order they were sent, so the
+    stream is cut in replies of the size expected by the oldest pending
+    transfer. This does no I/O by itself, `feed()` is called with whatever
+    the transport received.
+
+    Bytes received while no transfer is pending are IRQ bytes, passed to
+    `on_irq(line)`, or dropped if it is None. A 0 is dropped as well: it is
+    a late ACK, never an IRQ, see check_irq_line().
+
+    feed() stops at the first reply failing its ACK check, and returns the
+    error: the replies after it are no longer aligned, and the transport
+    is to fail them and resynchronize.
+    """
+
+    def __init__(self, on_irq=None):
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.on_irq = on_irq
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, kind, size, future, frames=None):
+        self.pending.append((kind, size, future, frames))
+
+    def feed(self, data):
+        self.buffer += data
+        while self.pending:
+            kind, size, future, frames = self.pending[0]
+            if len(self.buffer) < size:
+                return None
+            self.pending.popleft()
+            reply = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            error = resolve(kind, reply, future, frames)
+            if error is not None:
+                return error
+        if self.buffer:
+            irqs = bytes(self.buffer)
+            self.buffer.clear()
+            if self.on_irq is not None:
+                for line in irqs:
+                    if line != ACK:
+                        self.on_irq(line)
+        return None
+
+    def fail(self, error):
+        """Abort all pending transfers with `error`."""
+        while self.pending:
+            future = self.pending.popleft()[2]
+            if not future.done():
+                future.set_exception(error)
+        self.buffer.clear()
+
+
+class Resync:
+    """
+    Realignment of the byte stream with the bridge, after a lost reply.
+
+    Replies may still be on their way, or be lost, and the bridge may be
+    left in the middle of a frame, so nothing is known of what it owes.
+    A zero is the start of a NOP (a write of 0 bytes, only answered by an
+    ACK), which gives a way to find the end of a frame:
+
+    - _PADDING completes any partial frame, and all the bytes received are
+      dropped until the line is quiet for RESYNC_TIMEOUT;
+    - single zeros are then sent one at a time, each followed by a quiet
+      RESYNC_TIMEOUT, until one is answered by an ACK alone: that zero
+      ended a NOP;
+    - a NOP answered by exactly one ACK, then silence, confirms it.
+
+    Anything else, such as an IRQ byte or a reply slower than
+    RESYNC_TIMEOUT, starts over, up to RESYNC_ATTEMPTS times.
+
+    As ReplyQueue, this does no I/O by itself: `output` holds the bytes to
+    send, feed() is called with the bytes received, and poll() returns the
+    seconds to wait for them. `done` is set once the stream is aligned, or
+    `error` if it could not be.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.output = bytearray()
+        self.received = bytearray()
+        self.attempts = 0
+        self.done = False
+        self.error = None
+        self.probes = 0
+        self._send(_PADDING, 'drain')
+
+    def _send(self, data, state):
+        self.output += data
+        self.state = state
+        self.received.clear()
+        self.deadline = time.monotonic() + RESYNC_TIMEOUT
+
+    def feed(self, data):
+        if not data:
+            return
+        if self.state == 'drain':
+            self.deadline = time.monotonic() + RESYNC_TIMEOUT
+        else:
+            # the answer, unless more bytes follow
+            self.received += data
+            self.deadline = time.monotonic() + RESYNC_QUIET
+
+    def poll(self):
+        """Move on once the line was quiet until the deadline, return the time left."""
+        now = time.monotonic()
+        if now < self.deadline:
+            return self.deadline - now
+        if self.state == 'drain' or self.state == 'probe' and not self.received:
+            if self.probes == _HEADER.size:
+                # a zero per byte of a NOP, and none ended one
+                return self._retry()
+            self.probes += 1
+            self._send(_ZERO, 'probe')
+        elif self.received != _ZERO:
+            return self._retry()
+        elif self.state == 'probe':
+            self._send(_NOP, 'confirm')
+        else:
+            self.done = True
+            return None
+        return RESYNC_TIMEOUT
+
+    def _retry(self):
+        self.attempts += 1
+        if self.attempts >= RESYNC_ATTEMPTS:
+            self.error = WishboneError(f'{self.port}: could not resynchronize with the bridge')
+            return None
+        self.probes = 0
+        self._send(_PADDING, 'drain')
+        return RESYNC_TIMEOUT
+
+
+def _split(addr, n):
+    """Cut an access of `n` words into frames of at most MAX_WORDS words."""
+    step = 0 if addr & FIFO else 1
+    for offset in range(0, n, MAX_WORDS):
+        yield addr + offset * step, min(MAX_WORDS, n - offset)
+
+
+def plan_bursts(addrs, *, max_gap=1, volatile=()):
+    """
+    Merge register addresses into a minimal list of (addr, n) burst reads.
+
+    Only consecutive addresses are merged by default, so that no register
+    is read unless asked for. With a larger `max_gap`, such as MERGE_GAP,
+    addresses less than `max_gap` registers apart end-up in the same burst,
+    as reading a few extra registers is cheaper than an extra frame, unless
+    one of the registers in-between is in `volatile`: reading it has side
+    effects, such as taking a word out of a FIFO.
+    """
+    bursts = []
+    for addr in sorted(set(addrs)):
+        if bursts:
+            start, n = bursts[-1]
+            if addr - (start + n) < max_gap and not any(
+                    gap in volatile for gap in range(start + n, addr)):
+                bursts[-1] = (start, addr - start + 1)
+                continue
+        bursts.append((addr, 1))
+    return bursts
+
+
+def encode_read(frames, addr, n):
+    """Append the frames reading `n` words to `frames`, return the reply size."""
+    for addr, count in _split(addr, n):
+        frames += _HEADER.pack(CMD_READ, count * 4, addr)
+    return n * 4
+
+
+def encode_write(frames, addr, words):
+    """Append the frames writing `words` to `frames`, return the reply size."""
+    data = memoryview(to_wire(words)).cast('B')
+    n = 0
+    for i, (addr, count) in enumerate(_split(addr, len(data) // 4)):
+        frames += _HEADER.pack(CMD_WRITE, count * 4, addr)
+        frames += data[i * MAX_WORDS * 4:][:count * 4]
+        n += 1
+    return n
+
+
+def encode_rmw(frames, op, addr, a, b):
+    """
+    Append the frames of a read-modify-write, return the reply size.
+
+    The frames do the operation `op` (MASKED or CAS) with the words `a`
+    and `b` on the register at `addr`, and read its result. The reply is
+    the ACK of the operation and the result.
+    """
+    frames += _HEADER.pack(CMD_WRITE, 8, addr | op)
+    frames += _WORD.pack(a)
+    frames += _WORD.pack(b)
+    frames += _HEADER.pack(CMD_READ, 4, RESULT)
+    return 5
+
 
-    s.close()
-    return data
+def is_rmw(cmd, addr):
+    """Return whether a frame is an operation to keep with the read of its result."""
+    return cmd == CMD_WRITE and addr & RESULT != 0
+
+
+def is_idempotent(frames):
+    """Return whether `frames` can be sent again safely: no writes and no FIFO."""
+    frames = memoryview(frames)
+    pos = 0
+    while pos < len(frames):
+        if len(frames) - pos < _HEADER.size:
+            # not frames built by the host, such as the zeros of a resync
+            return False
+        cmd, length, addr = _HEADER.unpack_from(frames, pos)
+        if cmd != CMD_READ or addr & FIFO:
+            return False
+        pos += _HEADER.size
+    return True
+
+
+def check_irq_line(line):
+    """
+    Reject IRQ line 0, whose byte is the one of an ACK.
+
+    An IRQ byte sent by the bridge while a frame is on its way to it comes
+    before the reply: a 0 would be taken as the ACK of a write, which would
+    then seem to succeed while its own ACK shifts all the replies after it.
+    Any other line fails the ACK check of a write instead, and the stream
+    is resynchronized. Before the reply of a read, an IRQ byte of any line
+    is taken as the first byte of the value, and the last byte of the reply
+    is then taken as an IRQ: nothing detects it.
+    """
+    if line == ACK:
+        raise ValueError(f'IRQ line {ACK} is reserved: its byte is the one of an ACK')
+
+
+def check_acks(reply):
+    for ack in reply:
+        if ack != ACK:
+            raise WishboneAckError(f'invalid ack byte received: 0x{ack:02x}')
+
+
+def check_replies(frames, reply):
+    """Check the ACK replying to each write of `frames` in their `reply`."""
+    frames = memoryview(frames)
+    pos = offset = 0
+    while len(frames) - pos >= _HEADER.size and offset < len(reply):
+        cmd, length, _ = _HEADER.unpack_from(frames, pos)
+        if cmd == CMD_WRITE:
+            if reply[offset] != ACK:
+                raise WishboneAckError(f'invalid ack byte received: 0x{reply[offset]:02x}')
+            pos += _HEADER.size + length
+            offset += 1
+        elif cmd == CMD_READ:
+            pos += _HEADER.size
+            offset += length
+        else:
+            # not frames built by the host
+            return
+
+
+def to_wire(words):
+    """Convert integer words to their big-endian byte representation."""
+    if isinstance(words, (bytes, bytearray, memoryview)):
+        if memoryview(words).nbytes % 4 != 0:
+            raise ValueError('buffer length is not a multiple of 4 bytes')
+        return words
+    words = array('I', words)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words
+
+
+def from_wire(words):
+    """Convert an array('I') filled with big-endian bytes to native order."""
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(port):
+    """Return the shared connection to `port`, opening it on first use."""
+    with _buses_lock:
+        bus = _buses.get(port)
+        if bus is None or not bus.is_open:
+            bus = _buses[port] = WishboneBus(port)
+        return bus
+
+
+def release_bus(port):
+    """Close the shared connection to `port`, if any."""
+    with _buses_lock:
+        bus = _buses.pop(port, None)
+    if bus is not None:
+        bus.close()
+
+
+@atexit.register
+def close_all():
+    with _buses_lock:
+        buses = list(_buses.values())
+        _buses.clear()
+    for bus in buses:
+        bus.close()
+
+
+def xfer(port, addr, data):
+    try:
+        return get_bus(port).xfer(addr, data)
+    except serial.SerialException:
+        # the device went away: reopen it on next access
+        release_bus(port)
+        raise
 
 
 def read(port, addr):
@@ -45,20 +1027,203 @@ def write(port, addr, data):
     xfer(port, addr, data)
 
 
+def read_block(port, addr, n):
+    try:
+        return get_bus(port).read_block(addr, n)
+    except serial.SerialException:
+        release_bus(port)
+        raise
+
+
+def write_block(port, addr, words):
+    try:
+        get_bus(port).write_block(addr, words)
+    except serial.SerialException:
+        release_bus(port)
+        raise
+
+
+# number of words per batch of dump_region() and load_region()
+REGION_CHUNK = 4096
+
+
+def dump_region(bus, addr, n, *, chunk=REGION_CHUNK):
+    """Read `n` registers from `addr` with burst reads, yielding arrays of words."""
+    for offset in range(0, n, chunk):
+        yield bus.read_block(addr + offset, min(chunk, n - offset))
+
+
+def load_region(bus, addr, data, *, verify=True, chunk=REGION_CHUNK):
+    """
+    Write the big-endian words of the bytes-like `data` from `addr`.
+
+    With `verify`, read the region back, and raise WishboneError unless
+    its CRC-32 matches the one of `data`. Return the CRC-32 of `data`.
+    The views of `data` are released before returning or raising, so that
+    an mmap can be closed right after.
+    """
+    with memoryview(data) as view, view.cast('B') as data:
+        if len(data) % 4 != 0:
+            raise ValueError('data length is not a multiple of 4 bytes')
+        n = len(data) // 4
+        for offset in range(0, n, chunk):
+            with data[offset * 4:(offset + chunk) * 4] as words:
+                bus.write_block(addr + offset, words)
+        crc = zlib.crc32(data)
+    if verify:
+        readback = 0
+        for words in dump_region(bus, addr, n, chunk=chunk):
+            readback = zlib.crc32(to_wire(words), readback)
+        if readback != crc:
+            raise WishboneError(f'readback mismatch: crc32 0x{readback:08x}'
+                                f' instead of 0x{crc:08x}')
+    return crc
+
+
+# read-modify-write commands of the scripts and command line, with the
+# method of the bus doing them and their number of operands
+RMW_COMMANDS = {
+    'set': ('set_bits', 1),
+    'clear': ('clear_bits', 1),
+    'mask': ('masked_write', 2),
+    'cas': ('compare_and_swap', 2),
+}
+
+
+def rmw(bus, command, operands):
+    """Do the RMW_COMMANDS `command` with its ADDRESS and other `operands`."""
+    method, n = RMW_COMMANDS[command]
+    if len(operands) != n + 1:
+        raise ValueError(f'{command}: expected {n + 1} operands')
+    return getattr(bus, method)(*(int(x, 0) for x in operands))
+
+
+def run_script(bus, lines, out, *, interactive=False):
+    """
+    Execute the operations of `lines`, one per line, printing the reads to `out`.
+
+    Each line is either `ADDRESS` to read a register, `ADDRESS VALUE...` to
+    write registers from that address, `dump ADDRESS LENGTH`, or one of
+    `set ADDRESS BITS`, `clear ADDRESS BITS`, `mask ADDRESS MASK VALUE` and
+    `cas ADDRESS EXPECTED VALUE`, printing the resulting value, or the one
+    found by the compare-and-swap. Text after a `#` is ignored. The
+    operations are sent in batches, flushed at the end of input, every 64
+    operations, or after every line if `interactive`. On an invalid line,
+    the operations before it are flushed before raising ValueError.
+    """
+    batch = bus.batch()
+    results = []
+
+    def flush():
+        batch.flush()
+        for addr, future in results:
+            words = future.result()
+            if isinstance(words, int):
+                words = (words,)
+            for i, word in enumerate(words):
+                print(f'0x{addr + i:08x}: 0x{word:08x}', file=out)
+        results.clear()
+        out.flush()
+
+    for number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            if fields[0] == 'dump':
+                addr, n = int(fields[1], 0), int(fields[2], 0)
+                results.append((addr, batch.read_block(addr, n)))
+            elif fields[0] in RMW_COMMANDS:
+                results.append((int(fields[1], 0), rmw(batch, fields[0], fields[1:])))
+            elif len(fields) == 1:
+                addr = int(fields[0], 0)
+                results.append((addr, batch.read_block(addr, 1)))
+            else:
+                batch.write_block(int(fields[0], 0), [int(x, 0) for x in fields[1:]])
+        except (IndexError, ValueError):
+            flush()
+            raise ValueError(f'line {number}: invalid operation: {line.strip()}')
+        if interactive or len(batch) >= 64:
+            flush()
+    flush()
+
+
+def hexdump(addr, words, out):
+    for i in range(0, len(words), 4):
+        print(f'0x{addr + i:08x}:', *(f'{word:08x}' for word in words[i:i + 4]), file=out)
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description='access a wishbone bridge over a serial protocol')
+        description='access a wishbone bridge over a serial protocol',
+        epilog='commands: ADDRESS [VALUE] to read or write a register,'
+        ' dump ADDRESS LENGTH to read LENGTH registers,'
+        ' set|clear ADDRESS BITS, mask ADDRESS MASK VALUE or cas ADDRESS EXPECTED VALUE'
+        ' to modify a register in a single operation and print the result,'
+        ' load ADDRESS FILE to write registers from a file of big-endian words,'
+        ' script [FILE] to run the operations of FILE or stdin, one per line')
     parser.add_argument('--serial', dest='serial', nargs=1, required=True,
         help='serial port file to use for the communication')
-    parser.add_argument('address', nargs=1, type=lambda x : int(x, 0),
-        help='addres of the register to query')
-    parser.add_argument('value', nargs='?', type=lambda x : int(x, 0),
-        help='value to write, or if absent, a read operation is done')
+    parser.add_argument('--binary', action='store_true',
+        help='dump as raw big-endian words instead of hexadecimal text')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+        help='do not read back what was loaded to check it')
+    parser.add_argument('command', nargs='+',
+        help='ADDRESS [VALUE], dump ADDRESS LENGTH, set|clear|mask|cas ADDRESS ...,'
+        ' load ADDRESS FILE, or script [FILE]')
     args = parser.parse_args()
 
-    data = xfer(args.serial[0], args.address[0], args.value)
-    if data is not None:
-        print(f'0x{data:08x}')
+    port = args.serial[0]
+    command, operands = args.command[0], args.command[1:]
+    try:
+        if command == 'dump' and len(operands) == 2:
+            addr, n = int(operands[0], 0), int(operands[1], 0)
+            for words in dump_region(get_bus(port), addr, n):
+                if args.binary:
+                    sys.stdout.buffer.write(to_wire(words))
+                else:
+                    hexdump(addr, words, sys.stdout)
+                addr += len(words)
+
+        elif command in RMW_COMMANDS:
+            print(f'0x{rmw(get_bus(port), command, operands):08x}')
+
+        elif command == 'load' and len(operands) == 2:
+            addr = int(operands[0], 0)
+            with open(operands[1], 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size % 4 != 0:
+                    raise ValueError(f'{operands[1]}: size is not a multiple of 4 bytes')
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+            try:
+                crc = load_region(get_bus(port), addr, data, verify=args.verify)
+            finally:
+                if size:
+                    data.close()
+            print(f'loaded {size // 4} words, crc32 0x{crc:08x}'
+                  + (', verified' if args.verify else ''))
+
+        elif command == 'script' and len(operands) <= 1:
+            if operands and operands[0] != '-':
+                with open(operands[0]) as f:
+                    run_script(get_bus(port), f, sys.stdout)
+            else:
+                run_script(get_bus(port), sys.stdin, sys.stdout,
+                           interactive=sys.stdin.isatty())
+
+        elif len(args.command) <= 2:
+            addr = int(command, 0)
+            value = int(operands[0], 0) if operands else None
+            data = xfer(port, addr, value)
+            if data is not None:
+                print(f'0x{data:08x}')
+
+        else:
+            parser.error(f'invalid command: {" ".join(args.command)}')
+    except ValueError as e:
+        parser.error(str(e))
+    except WishboneError as e:
+        sys.exit(f'{parser.prog}: {e}')
 
 
 if __name__ == "__main__":
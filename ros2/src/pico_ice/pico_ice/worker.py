@@ -0,0 +1,140 @@
+from collections import deque
+from concurrent.futures import Future
+import threading
+
+from rclpy.qos import HistoryPolicy
+
+
+# what to do with a new request when the queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+
+class BusWorker:
+    """
+    Thread doing the bus transfers requested from rclpy callbacks.
+
+    submit() only queues the request and returns a Future, so that a slow
+    bus never stalls the executor: timers and subscriptions keep their
+    latency whatever the load of the bus. The queue holds up to `depth`
+    requests, after which `policy` drops the oldest request (as the
+    KEEP_LAST history of ROS2), drops the new one, or blocks the caller.
+    A request submitted with the `key` of a request still queued replaces
+    it, so that a timer never has more than one tick waiting.
+
+    The Future of a dropped request is cancelled, and `callback(future)`
+    is called once the request is done or dropped: from the worker thread
+    when it is done, and from the thread calling submit() or close() when
+    it is dropped, with no lock held, so that the callback may submit again.
+
+        worker = BusWorker(depth=1)
+        worker.submit(bus.read, 0x1000, key='x', callback=on_value)
+    """
+
+    def __init__(self, *, depth=10, policy=DROP_OLDEST, name='pico_ice bus worker'):
+        self.depth = depth
+        self.policy = policy
+        self.queue = deque()
+        self.keys = {}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.completed = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_qos(cls, qos, **kwargs):
+        """Return a BusWorker keeping the last `depth` requests, or all, as `qos`."""
+        if qos.history == HistoryPolicy.KEEP_ALL:
+            return cls(depth=qos.depth or 1000, policy=BLOCK, **kwargs)
+        return cls(depth=qos.depth, policy=DROP_OLDEST, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def submit(self, fn, *args, key=None, callback=None):
+        """Queue `fn(*args)` to be called from the worker thread, return its Future."""
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        with self.cond:
+            dropped = self._queue((key, future, fn, args))
+        # outside of the lock, as the callbacks run from cancel()
+        for old in dropped:
+            old.cancel()
+        return future
+
+    def _queue(self, request):
+        """Queue `request` with the lock held, return the Futures of the requests dropped."""
+        key, future = request[:2]
+        if self.closed:
+            return [future]
+        dropped = []
+        old = self.keys.get(key) if key is not None else None
+        if old is not None:
+            self.queue.remove(old)
+            dropped.append(old[1])
+            self.superseded += 1
+        elif len(self.queue) >= self.depth:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return [future]
+            if self.policy == BLOCK:
+                self.cond.wait_for(lambda: len(self.queue) < self.depth or self.closed)
+                if self.closed:
+                    return [future]
+            else:
+                dropped.append(self._forget(self.queue.popleft())[1])
+                self.dropped += 1
+        self.queue.append(request)
+        if key is not None:
+            self.keys[key] = request
+        self.cond.notify_all()
+        return dropped
+
+    def close(self):
+        """Cancel the queued requests and stop the worker thread."""
+        with self.cond:
+            self.closed = True
+            queued, self.queue = self.queue, deque()
+            self.keys.clear()
+            self.cond.notify_all()
+        for _, future, _, _ in queued:
+            future.cancel()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _forget(self, request):
+        if request[0] is not None:
+            del self.keys[request[0]]
+        return request
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closed)
+                if self.closed:
+                    return
+                _, future, fn, args = self._forget(self.queue.popleft())
+                self.cond.notify_all()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self.errors += 1
+                future.set_exception(e)
+            else:
+                self.completed += 1
+                future.set_result(result)
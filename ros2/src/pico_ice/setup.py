@@ -22,6 +22,11 @@ setup(
         'console_scripts': [
             'talker = pico_ice.publisher_member_function:main',
             'listener = pico_ice.subscriber_member_function:main',
+            'emulator = pico_ice.emulator:main',
+            'daemon = pico_ice.daemon:main',
+            'benchmark = pico_ice.benchmark:main',
+            'trace = pico_ice.trace:main',
+            'wishbone_serial = pico_ice.wishbone_serial:main',
         ],
 	},
 )
@@ -0,0 +1,51 @@
+import time
+
+from pico_ice.cache import RegisterCache, Static, TTL, WriteThrough
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.wishbone_serial import WishboneBus
+
+
+def test_policies():
+    with BridgeEmulator(registers={0: 0xC0FFEE, 1: 1, 2: 2, 0x10: 10}) as emu:
+        with WishboneBus(emu.port) as bus:
+            cache = RegisterCache(bus)
+            cache.set_policy(0, Static(), n=2)
+            cache.set_policy(0x10, TTL(0.05))
+            cache.set_policy(0x20, WriteThrough())
+
+            assert list(cache.read_block(0, 3)) == [0xC0FFEE, 1, 2]
+            frames = emu.frames
+            # only the register with no cache policy is read again
+            emu.registers[1] = emu.registers[2] = 3
+            assert list(cache.read_block(0, 3)) == [0xC0FFEE, 1, 3]
+            assert emu.frames == frames + 1
+
+            assert cache.read(0x10) == 10
+            emu.registers[0x10] = 11
+            assert cache.read(0x10) == 10
+            time.sleep(0.05)
+            assert cache.read(0x10) == 11
+
+            # read from the bridge until written
+            emu.registers[0x20] = 5
+            assert cache.read(0x20) == 5
+            cache.write(0x20, 6)
+            emu.registers[0x20] = 7
+            assert cache.read(0x20) == 6
+            assert (cache.hits, cache.misses) == (4, 7)
+
+
+def test_invalidate_and_rmw():
+    with BridgeEmulator(registers={0: 1, 1: 0x0F}) as emu:
+        with WishboneBus(emu.port) as bus:
+            cache = RegisterCache(bus)
+            cache.set_policy(0, Static(), n=2)
+            assert cache.read(0) == 1
+            emu.registers[0] = 2
+            cache.invalidate(0)
+            assert cache.read(0) == 2
+            # the cached value follows the result of the operation
+            assert cache.set_bits(1, 0xF0) == 0xFF
+            assert cache.read(1) == 0xFF
+            assert cache.compare_and_swap(1, 0xFF, 0x10) == 0xFF
+            assert cache.read(1) == 0x10 == emu.registers[1]
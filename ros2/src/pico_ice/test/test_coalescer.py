@@ -0,0 +1,51 @@
+import threading
+
+from pico_ice.coalescer import WriteCoalescer
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.wishbone_serial import WishboneBus, WishboneError
+
+
+class FlakyBus:
+    """Bus failing its first batch, and recording the writes of the others."""
+
+    def __init__(self):
+        self.failures = 1
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.failures:
+            self.failures -= 1
+            raise WishboneError('flaky bus')
+
+    def write_block(self, addr, words):
+        self.writes.append((addr, list(words)))
+
+
+def test_latest_values_as_bursts():
+    with BridgeEmulator(latency=0.01) as emu:
+        with WishboneBus(emu.port) as bus, WriteCoalescer(bus) as writer:
+            for i in range(100):
+                writer.write_many({0x10: i, 0x11: i + 1, 0x20: i + 2})
+            assert writer.flush(1.0)
+            assert [emu.registers[addr] for addr in (0x10, 0x11, 0x20)] == [99, 100, 101]
+            assert writer.written + writer.superseded == 300
+            assert writer.superseded > 0
+
+
+def test_failed_flush_written_again():
+    errors = []
+    bus = FlakyBus()
+    with WriteCoalescer(bus, on_error=errors.append, retry_delay=0.01) as writer:
+        writer.write_many({1: 10, 2: 20, 5: 50})
+        assert writer.flush(1.0)
+    assert [str(e) for e in errors] == ['flaky bus']
+    # sent by the failed batch, then again
+    assert bus.writes == [(1, [10, 20]), (5, [50])] * 2
+    assert (writer.errors, writer.written) == (1, 3)
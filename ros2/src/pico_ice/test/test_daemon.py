@@ -0,0 +1,58 @@
+import threading
+
+from pico_ice.daemon import BridgeDaemon
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.stats import BusStats
+from pico_ice.wishbone_serial import WishboneBus
+
+
+class LossyOnceEmulator(BridgeEmulator):
+    """Bridge losing the first 2 bytes of the reply to its first read."""
+
+    lossy = True
+
+    def read_cb(self, addr, size):
+        data = super().read_cb(addr, size)
+        if self.lossy:
+            self.lossy = False
+            data = data[2:]
+        return data
+
+
+def test_clients_get_their_own_replies(tmp_path):
+    errors = []
+
+    def client(url, base):
+        try:
+            with WishboneBus(url) as bus:
+                for i in range(50):
+                    bus.write_block(base, [base + i] * 4)
+                    assert list(bus.read_block(base, 4)) == [base + i] * 4
+                assert bus.set_bits(base, 1 << 20) == base + 49 | 1 << 20
+        except Exception as e:
+            errors.append(e)
+
+    with BridgeEmulator(latency=0.001) as emu:
+        with BridgeDaemon(emu.port, str(tmp_path / 'pico_ice.sock')) as daemon:
+            threads = [threading.Thread(target=client, args=(daemon.url, base))
+                       for base in (0x100, 0x200, 0x300, 0x400)]
+            for thread in threads:
+                thread.start()
+            # a large dump goes through alongside them
+            with WishboneBus(daemon.url) as bus:
+                assert len(bus.read_block(0x10000, 4096)) == 4096
+            for thread in threads:
+                thread.join()
+    assert errors == []
+
+
+def test_client_resyncs_after_a_lost_reply(tmp_path):
+    # the daemon drops the transfer and resynchronizes with the bridge,
+    # the client times out and resynchronizes with the daemon
+    with LossyOnceEmulator(registers={5: 55, 6: 66}) as emu:
+        with BridgeDaemon(emu.port, str(tmp_path / 'pico_ice.sock'), timeout=0.2) as daemon:
+            with WishboneBus(daemon.url, timeout=0.2) as bus:
+                bus.stats = BusStats()
+                assert bus.read(5) == 55
+                assert bus.read(6) == 66
+                assert bus.stats.retries == 1
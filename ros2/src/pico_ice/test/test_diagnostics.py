@@ -0,0 +1,18 @@
+from diagnostic_msgs.msg import DiagnosticStatus
+from pico_ice.diagnostics import bus_status
+from pico_ice.stats import BusStats
+from pico_ice.wishbone_serial import WishboneTimeout
+
+
+def test_bus_status():
+    stats = BusStats()
+    stats.record('read', 6, 4, 1000)
+    status = bus_status('front', '/dev/ttyACM1', stats.snapshot())
+    assert (status.name, status.hardware_id) == ('pico_ice: front', '/dev/ttyACM1')
+    assert status.level == DiagnosticStatus.OK
+    values = {v.key: v.value for v in status.values}
+    assert (values['tx_bytes'], values['read.count']) == ('6', '1')
+
+    stats.record_error(WishboneTimeout())
+    status = bus_status('front', '/dev/ttyACM1', stats.snapshot())
+    assert status.level == DiagnosticStatus.WARN
@@ -0,0 +1,44 @@
+from array import array
+import math
+
+from pico_ice.filters import Deadband, IfNot, OnChange, RateLimit, Shadow
+
+
+def test_if_not():
+    f = IfNot(0xFF)
+    assert not f.accept(0xFF, None, 0.0)
+    assert f.accept(0x12, None, 0.0)
+
+
+def test_if_not_checks_each_register_of_a_block():
+    f = IfNot(0xFF)
+    assert not f.accept(array('I', [0xFF, 0xFF]), None, 0.0)
+    assert f.accept(array('I', [0xFF, 0x12]), None, 0.0)
+
+
+def test_on_change():
+    f = OnChange()
+    assert f.accept(1, None, math.inf)
+    assert not f.accept(1, 1, 1.0)
+    assert f.accept(2, 1, 1.0)
+
+
+def test_deadband():
+    f = Deadband(2)
+    assert f.accept(10, None, math.inf)
+    assert not f.accept(12, 10, 1.0)
+    assert f.accept(13, 10, 1.0)
+    assert not f.accept(array('I', [10, 12]), array('I', [11, 11]), 1.0)
+    assert f.accept(array('I', [10, 15]), array('I', [11, 11]), 1.0)
+
+
+def test_shadow_rate_limit_and_heartbeat():
+    shadow = Shadow([OnChange(), RateLimit(1.0, max_silence=10.0)])
+    assert shadow.update(1, 0.0)
+    # changed, but too soon
+    assert not shadow.update(2, 0.5)
+    assert shadow.update(2, 1.5)
+    # unchanged, until the heartbeat
+    assert not shadow.update(2, 5.0)
+    assert shadow.update(2, 11.5)
+    assert (shadow.value, shadow.accepted, shadow.rejected) == (2, 3, 2)
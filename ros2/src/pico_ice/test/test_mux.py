@@ -0,0 +1,31 @@
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.mux import BusMultiplexer
+from pico_ice.wishbone_serial import WishboneAckError, WishboneTimeout
+import pytest
+
+
+def test_timeout_resyncs_one_device():
+    with BridgeEmulator(latency=0.04, registers={5: 55, 6: 66}) as slow, \
+            BridgeEmulator(registers={1: 11}) as fast:
+        with BusMultiplexer({'slow': slow.port, 'fast': fast.port}, timeout=0.01) as mux:
+            with pytest.raises(WishboneTimeout):
+                mux['slow'].write(7, 77)
+            # the other device is not held by the resynchronization
+            assert mux['fast'].read(1) == 11
+            mux['slow'].timeout = 1.0
+            assert [mux['slow'].read(addr) for addr in (5, 6, 7)] == [55, 66, 77]
+
+
+def test_irq_crossing_a_write_resyncs():
+    with BridgeEmulator(registers={5: 55, 6: 66}) as emu:
+        with BusMultiplexer({'dev': emu.port}, timeout=0.2) as mux:
+            emu.cross_irq(3)
+            b = mux['dev'].batch()
+            written, first = b.write(7, 77), b.read(5)
+            b.submit()
+            with pytest.raises(WishboneAckError):
+                written.result()
+            # the replies after the bad ACK are no longer aligned
+            with pytest.raises(WishboneAckError):
+                first.result()
+            assert [mux['dev'].read(addr) for addr in (5, 6, 7)] == [55, 66, 77]
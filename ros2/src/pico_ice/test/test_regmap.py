@@ -0,0 +1,44 @@
+from array import array
+
+from pico_ice import regmap
+from pico_ice.regmap import Register, RegisterMap
+import pytest
+
+
+def imu():
+    return RegisterMap(0x1000, [
+        Register('x', 0, signed=True, scale=0.001),
+        Register('count', 1),
+        Register('flags', 3, bits={'ready': (0, 1), 'mode': (4, 3)}),
+    ])
+
+
+def test_decode():
+    words = array('I', [(-1500) & 0xFFFFFFFF, 7, 0xDEAD, 0x51])
+    values = imu().decode(words)
+    assert values['x'] == pytest.approx(-1.5)
+    assert (values['count'], values['ready'], values['mode']) == (7, 1, 5)
+    assert 'flags' not in values
+
+
+def test_encode_rounds_the_scaled_values():
+    m = imu()
+    assert list(m.encode({'x': 0.0016, 'count': 3, 'ready': 1, 'mode': 2})) == [2, 3, 0, 0x21]
+    assert m.encode_dict({'x': -0.0016}) == {0x1000: 0xFFFFFFFE}
+    assert m.encode_dict({'mode': 2}) == {0x1003: 0x20}
+
+
+def test_decode_many_with_and_without_numpy(monkeypatch):
+    words = array('I', [1000, 1, 0, 0x11, (-2000) & 0xFFFFFFFF, 2, 0, 0x20])
+    with_numpy = imu().decode_many(words)
+    monkeypatch.setattr(regmap, 'numpy', None)
+    without = imu().decode_many(words)
+    assert without == {'x': [1.0, -2.0], 'count': [1, 2], 'ready': [1, 0], 'mode': [1, 2]}
+    assert {name: list(values) for name, values in with_numpy.items()} == without
+
+
+def test_bitfields_cannot_be_signed_or_scaled():
+    with pytest.raises(ValueError):
+        Register('flags', 0, signed=True, bits={'ready': (0, 1)})
+    with pytest.raises(ValueError):
+        Register('flags', 0, scale=0.1, bits={'ready': (0, 1)})
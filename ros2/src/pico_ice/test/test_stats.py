@@ -0,0 +1,46 @@
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.stats import BusStats, OpStats
+from pico_ice.wishbone_serial import WishboneAckError, WishboneBus, WishboneTimeout
+import pytest
+
+
+def test_percentiles_are_upper_bounds():
+    s = OpStats()
+    for ns in [100] * 98 + [3000, 70000]:
+        s.histogram[ns.bit_length()] += 1
+        s.count += 1
+    assert s.percentile(50) == pytest.approx(128e-9)
+    assert s.percentile(99) == pytest.approx(4096e-9)
+    assert s.maximum() == pytest.approx(131072e-9)
+    assert OpStats().snapshot() == {'count': 0, 'max_s': 0.0, 'p50_s': 0.0, 'p99_s': 0.0}
+
+
+def test_errors():
+    stats = BusStats()
+    stats.record_error(WishboneTimeout())
+    stats.record_error(WishboneAckError())
+    stats.record_error(OSError())
+    stats.record_retry()
+    stats.record_resync()
+    snapshot = stats.snapshot()
+    assert [snapshot[key] for key in ('errors', 'timeouts', 'bad_acks', 'retries', 'resyncs')] \
+        == [3, 1, 1, 1, 1]
+
+
+def test_transfers_of_a_bus():
+    with BridgeEmulator(registers={1: 11}) as emu:
+        with WishboneBus(emu.port) as bus:
+            bus.stats = BusStats()
+            bus.read(1)
+            bus.write(2, 22)
+            bus.set_bits(2, 1)
+            with bus.batch() as b:
+                b.read(1)
+                b.write(3, 33)
+    snapshot = bus.stats.snapshot()
+    assert {op: s['count'] for op, s in snapshot['ops'].items()} == {
+        'read': 1, 'write': 1, 'rmw': 1, 'batch': 1}
+    # frames of 6 byte headers and their words, replies of words and ACKs
+    assert snapshot['tx_bytes'] == (6) + (6 + 4) + (6 + 8 + 6) + (6 + 6 + 4)
+    assert snapshot['rx_bytes'] == (4) + (1) + (1 + 4) + (4 + 1)
+    assert snapshot['ops']['read']['max_s'] > 0
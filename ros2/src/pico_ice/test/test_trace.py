@@ -0,0 +1,34 @@
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.trace import replay, TraceReader, TraceWriter
+from pico_ice.wishbone_serial import WishboneBus
+import pytest
+
+
+def record(path, registers):
+    with BridgeEmulator(latency=0.001, registers=registers) as emu:
+        with WishboneBus(emu.port) as bus, TraceWriter(path) as trace:
+            bus.trace = trace
+            for i in range(20):
+                bus.read(i % 4)
+            # split over CONTINUED records
+            bus.write_block(0x100, range(40))
+            assert list(bus.read_block(0x100, 40)) == list(range(40))
+
+
+def test_stats_same_with_and_without_numpy(tmp_path):
+    pytest.importorskip('numpy')
+    record(tmp_path / 'bus.trace', {i: i for i in range(4)})
+    with TraceReader(tmp_path / 'bus.trace') as reader:
+        with_numpy = reader.stats()
+        reader.records = None
+        without = reader.stats()
+    assert with_numpy['tx_chunks'] == 22
+    assert with_numpy == pytest.approx(without)
+
+
+def test_replay_matches(tmp_path):
+    record(tmp_path / 'bus.trace', {i: i for i in range(4)})
+    with TraceReader(tmp_path / 'bus.trace') as reader:
+        with BridgeEmulator(registers={i: i for i in range(4)}) as emu:
+            with WishboneBus(emu.port) as bus:
+                assert replay(reader, bus) == {'transfers': 22, 'mismatches': 0, 'errors': 0}
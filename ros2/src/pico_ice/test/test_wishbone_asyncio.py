@@ -0,0 +1,71 @@
+import asyncio
+
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.wishbone_asyncio import AsyncWishboneBus
+from pico_ice.wishbone_serial import WishboneAckError, WishboneTimeout
+import pytest
+import serial
+
+
+def test_concurrent_operations():
+    n = 5000
+
+    async def main(port):
+        async with AsyncWishboneBus(port) as bus:
+            # a large block keeps the writer busy while the other frames queue up
+            await asyncio.gather(
+                bus.write_block(0x1000, range(n)),
+                *(bus.write(addr, addr * 10) for addr in range(10)))
+            return await asyncio.gather(
+                bus.read_block(0x1000, n),
+                bus.set_bits(1, 0x100),
+                *(bus.read(addr) for addr in range(10)))
+
+    with BridgeEmulator(latency=0.001) as emu:
+        block, rmw, *words = asyncio.run(main(emu.port))
+    assert list(block) == list(range(n))
+    assert rmw == 0x10A
+    # the frames are sent in the order of the calls, so after the set_bits()
+    assert words == [0x10A if addr == 1 else addr * 10 for addr in range(10)]
+
+
+def test_timeout_resyncs():
+    async def main(port):
+        async with AsyncWishboneBus(port, timeout=0.01) as bus:
+            with pytest.raises(WishboneTimeout):
+                await bus.write(7, 77)
+            bus.timeout = 1.0
+            # sent once the stream is aligned again
+            return await asyncio.gather(*(bus.read(addr) for addr in (5, 6, 7)))
+
+    with BridgeEmulator(latency=0.04, registers={5: 55, 6: 66}) as emu:
+        assert asyncio.run(main(emu.port)) == [55, 66, 77]
+
+
+def test_irq_crossing_a_write_resyncs():
+    async def main(emu):
+        async with AsyncWishboneBus(emu.port, timeout=0.2) as bus:
+            emu.cross_irq(3)
+            written = bus.write(7, 77)
+            first = bus.read(5)
+            results = await asyncio.gather(written, first, return_exceptions=True)
+            assert [type(r) for r in results] == [WishboneAckError] * 2
+            return await asyncio.gather(*(bus.read(addr) for addr in (5, 6, 7)))
+
+    with BridgeEmulator(registers={5: 55, 6: 66}) as emu:
+        assert asyncio.run(main(emu)) == [55, 66, 77]
+
+
+def test_serial_error_reaches_the_transfers():
+    async def main(port):
+        async with AsyncWishboneBus(port) as bus:
+            def unplugged(size):
+                raise serial.SerialException('device unplugged')
+
+            bus.serial.read = unplugged
+            with pytest.raises(serial.SerialException, match='unplugged'):
+                await bus.read(5)
+            assert not bus.is_open
+
+    with BridgeEmulator(latency=0.01) as emu:
+        asyncio.run(main(emu.port))
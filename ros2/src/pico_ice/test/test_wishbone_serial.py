@@ -0,0 +1,252 @@
+import io
+import mmap
+import os
+import sys
+import time
+import zlib
+
+from pico_ice.emulator import BridgeEmulator
+from pico_ice.stats import BusStats
+from pico_ice.wishbone_serial import (
+    dump_region, load_region, main, MAX_WORDS, MERGE_GAP, plan_bursts, run_script, to_wire,
+    WishboneAckError, WishboneBus, WishboneTimeout)
+import pytest
+
+
+class SlowOnceEmulator(BridgeEmulator):
+    """Bridge replying late to its first read only."""
+
+    slow = True
+
+    def read_cb(self, addr, size):
+        if self.slow:
+            self.slow = False
+            time.sleep(0.04)
+        return super().read_cb(addr, size)
+
+
+class LossyOnceEmulator(BridgeEmulator):
+    """Bridge losing the first 2 bytes of the reply to its first read."""
+
+    lossy = True
+
+    def read_cb(self, addr, size):
+        data = super().read_cb(addr, size)
+        if self.lossy:
+            self.lossy = False
+            data = data[2:]
+        return data
+
+
+def test_burst_split():
+    n = 2 * MAX_WORDS + 5
+    with BridgeEmulator() as emu:
+        with WishboneBus(emu.port) as bus:
+            bus.write_block(0x100, list(range(n)))
+            assert emu.frames == 3
+            assert [emu.registers[0x100 + i] for i in range(n)] == list(range(n))
+            assert list(bus.read_block(0x100, n)) == list(range(n))
+            assert emu.frames == 6
+
+
+def test_plan_bursts():
+    addrs = [0x1FFF, 0x2001, 0x2002, 0x2010]
+    assert plan_bursts(addrs) == [(0x1FFF, 1), (0x2001, 2), (0x2010, 1)]
+    assert plan_bursts(addrs, max_gap=MERGE_GAP) == [(0x1FFF, 4), (0x2010, 1)]
+    # never through a register whose read has side effects
+    assert plan_bursts(addrs, max_gap=MERGE_GAP, volatile=range(0x2000, 0x2001)) == [
+        (0x1FFF, 1), (0x2001, 2), (0x2010, 1)]
+
+
+def test_batch_replies_go_to_their_operation():
+    with BridgeEmulator(registers={1: 11, 2: 22, 3: 33}) as emu:
+        with WishboneBus(emu.port) as bus:
+            with bus.batch() as b:
+                first = b.read(1)
+                written = b.write(4, 44)
+                block = b.read_block(1, 4)
+                swapped = b.compare_and_swap(2, 22, 23)
+                last = b.read(2)
+            assert first.result() == 11
+            assert written.result() is None
+            assert list(block.result()) == [11, 22, 33, 44]
+            assert swapped.result() == 22
+            assert last.result() == 23
+
+
+def test_rmw():
+    with BridgeEmulator(registers={1: 0xF0}) as emu:
+        with WishboneBus(emu.port) as bus:
+            assert bus.set_bits(1, 0x0F) == 0xFF
+            assert bus.clear_bits(1, 0x3C) == 0xC3
+            assert bus.masked_write(1, 0xFF00, 0x1234) == 0x12C3
+            # a failed swap returns the value found and leaves it alone
+            assert bus.compare_and_swap(1, 0, 7) == 0x12C3
+            assert bus.compare_and_swap(1, 0x12C3, 7) == 0x12C3
+            assert bus.read(1) == 7
+
+
+def test_resync_waits_for_late_replies():
+    # the bridge replies after the timeout: the late ACK of the write, and
+    # those of the NOPs of the resync, must not be taken as the next replies
+    with BridgeEmulator(latency=0.04, registers={5: 55, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.01) as bus:
+            with pytest.raises(WishboneTimeout):
+                bus.write(7, 77)
+            bus.timeout = 1.0
+            assert [bus.read(addr) for addr in (5, 6, 7)] == [55, 66, 77]
+
+
+def test_resync_after_lost_bytes():
+    with LossyOnceEmulator(registers={5: 55, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            bus.stats = BusStats()
+            assert bus.read(5) == 55
+            assert bus.read(6) == 66
+            assert (bus.stats.timeouts, bus.stats.retries) == (1, 1)
+
+
+def test_resync_completes_a_partial_write_frame():
+    # the bridge waits for the 7 bytes missing to the write, and takes the
+    # read frame as part of it
+    with BridgeEmulator(registers={5: 55, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            os.write(emu.slave, bytes([0x00, 0x04, 0x00]))
+            assert bus.read(5) == 55
+            assert bus.read(6) == 66
+
+
+def test_resync_completes_a_partial_read_frame():
+    # the write frame ends the read frame, whose reply fails the ACK check,
+    # and its rest starts a write at 0 that the zeros of the resync complete
+    with BridgeEmulator(registers={0x100: 55, 0x101: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            os.write(emu.slave, bytes([0x01, 0x04, 0x00, 0x00]))
+            with pytest.raises(WishboneAckError):
+                bus.write(7, 77)
+            assert [bus.read(addr) for addr in (0x100, 0x101)] == [55, 66]
+
+
+def test_irq_crossing_a_write_resyncs():
+    with BridgeEmulator(registers={5: 55}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            emu.cross_irq(3)
+            with pytest.raises(WishboneAckError):
+                bus.write(7, 77)
+            assert emu.registers[7] == 77
+            assert bus.read(5) == 55
+
+
+def test_irq_crossing_a_batch_resyncs():
+    with BridgeEmulator(registers={5: 55, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            bus.stats = BusStats()
+            with bus.batch() as b:
+                b.write(7, 77)
+                first = b.read(5)
+                emu.cross_irq(3)
+                with pytest.raises(WishboneAckError):
+                    b.submit().result()
+            with pytest.raises(WishboneAckError):
+                first.result()
+            assert bus.stats.resyncs == 1
+            assert [bus.read(addr) for addr in (5, 6, 7)] == [55, 66, 77]
+
+
+def test_irq_crossing_a_read_goes_undetected():
+    # the IRQ byte comes first in the value, and the last byte of the reply
+    # is taken as an IRQ: the stream stays aligned, but both are wrong
+    with BridgeEmulator(registers={5: 0x11223344, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.2) as bus:
+            lines = []
+            bus.on_irq(None, lines.append)
+            emu.cross_irq(3)
+            assert bus.read(5) == 0x03112233
+            assert bus.read(6) == 66
+            bus.poll_irq(0.1)
+            assert lines == [0x44]
+
+
+def test_read_retried_after_timeout():
+    with SlowOnceEmulator(registers={5: 55, 6: 66}) as emu:
+        with WishboneBus(emu.port, timeout=0.01) as bus:
+            bus.stats = BusStats()
+            assert bus.read(5) == 55
+            assert bus.read(6) == 66
+            stats = bus.stats.snapshot()
+            assert (stats['timeouts'], stats['retries'], stats['resyncs']) == (1, 1, 1)
+            assert stats['ops']['read']['count'] == 2
+
+
+def test_write_not_retried():
+    with BridgeEmulator(latency=0.04) as emu:
+        with WishboneBus(emu.port, timeout=0.01) as bus:
+            bus.stats = BusStats()
+            with pytest.raises(WishboneTimeout):
+                bus.write(7, 77)
+            assert (bus.stats.timeouts, bus.stats.retries) == (1, 0)
+
+
+def test_run_script():
+    script = [
+        '0x10 1 2 3  # three registers',
+        '',
+        '0x11',
+        'dump 0x10 3',
+        'set 0x10 0x100',
+        'cas 0x12 3 4',
+    ]
+    out = io.StringIO()
+    with BridgeEmulator() as emu:
+        with WishboneBus(emu.port) as bus:
+            run_script(bus, script, out)
+    assert out.getvalue().split('\n') == [
+        '0x00000011: 0x00000002',
+        '0x00000010: 0x00000001',
+        '0x00000011: 0x00000002',
+        '0x00000012: 0x00000003',
+        '0x00000010: 0x00000101',
+        '0x00000012: 0x00000003',
+        '',
+    ]
+    assert emu.registers == {0x10: 0x101, 0x11: 2, 0x12: 4}
+
+
+def test_run_script_flushes_before_an_error():
+    out = io.StringIO()
+    with BridgeEmulator(registers={1: 11}) as emu:
+        with WishboneBus(emu.port) as bus:
+            with pytest.raises(ValueError, match='line 3'):
+                run_script(bus, ['2 22', '1', 'set 1'], out)
+    assert out.getvalue() == '0x00000001: 0x0000000b\n'
+    assert emu.registers[2] == 22
+
+
+def test_load_and_dump_region():
+    data = bytes(range(256)) * 3
+    with BridgeEmulator() as emu:
+        with WishboneBus(emu.port) as bus:
+            assert load_region(bus, 0x1000, data, chunk=50) == zlib.crc32(data)
+            dump = b''.join(bytes(to_wire(words))
+                            for words in dump_region(bus, 0x1000, len(data) // 4, chunk=50))
+    assert dump == data
+
+
+def test_load_region_releases_the_data():
+    m = mmap.mmap(-1, 6)
+    with BridgeEmulator() as emu:
+        with WishboneBus(emu.port) as bus:
+            with pytest.raises(ValueError):
+                load_region(bus, 0, m)
+    m.close()
+
+
+def test_load_command_rejects_odd_sizes(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'table.bin'
+    path.write_bytes(b'abcdef')
+    with BridgeEmulator() as emu:
+        monkeypatch.setattr(sys, 'argv', ['wishbone_serial', '--serial', emu.port,
+                                          'load', '0', str(path)])
+        with pytest.raises(SystemExit):
+            main()
+    assert 'not a multiple of 4 bytes' in capsys.readouterr().err
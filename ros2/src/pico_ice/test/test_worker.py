@@ -0,0 +1,63 @@
+import threading
+
+from pico_ice.worker import BusWorker, DROP_NEWEST
+from rclpy.qos import HistoryPolicy, QoSProfile
+
+
+def busy(worker):
+    """Keep the worker busy until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    worker.submit(lambda: (started.set(), release.wait()))
+    started.wait()
+    return release
+
+
+def test_request_replaced_by_its_key():
+    with BusWorker() as worker:
+        release = busy(worker)
+        first = worker.submit(lambda: 1, key='tick')
+        second = worker.submit(lambda: 2, key='tick')
+        release.set()
+        assert second.result() == 2
+        assert first.cancelled()
+        assert worker.superseded == 1
+
+
+def test_drop_policies():
+    with BusWorker(depth=1) as worker:
+        release = busy(worker)
+        oldest = worker.submit(lambda: 1)
+        newest = worker.submit(lambda: 2)
+        release.set()
+        assert oldest.cancelled() and newest.result() == 2
+    with BusWorker(depth=1, policy=DROP_NEWEST) as worker:
+        release = busy(worker)
+        oldest = worker.submit(lambda: 1)
+        newest = worker.submit(lambda: 2)
+        release.set()
+        assert oldest.result() == 1 and newest.cancelled()
+
+
+def test_callback_of_a_dropped_request_can_submit():
+    results = []
+
+    def callback(future):
+        if future.cancelled():
+            results.append(worker.submit(lambda: 3, key='tick'))
+
+    with BusWorker() as worker:
+        release = busy(worker)
+        worker.submit(lambda: 1, key='tick', callback=callback)
+        worker.submit(lambda: 2, key='tick')
+        release.set()
+        assert [future.result() for future in results] == [3]
+        assert len(worker) == 0
+
+
+def test_from_qos():
+    worker = BusWorker.from_qos(QoSProfile(depth=5))
+    assert (worker.depth, worker.policy) == (5, 'drop_oldest')
+    worker.close()
+    worker = BusWorker.from_qos(QoSProfile(history=HistoryPolicy.KEEP_ALL, depth=0))
+    assert worker.policy == 'block'
+    worker.close()
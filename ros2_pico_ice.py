@@ -0,0 +1,13 @@
+from sensor_msgs.msg import Imu
+
+import pico_ice.runtime as ice
+
+
+ice.run([
+    ice.Publish(0x1001, '/pico_ice_button', ice.trigger_every_100ms),
+    ice.Publish(0x2000, '/pico_ice_ir_remote', ice.trigger_on_interrupt),
+    ice.Publish(0x1003, '/pico_ice_bosch_bme280', ice.trigger_every_10ms),
+    ice.Subscribe(0x1000, '/imu.orientation.x', Imu, scale=1000),
+    ice.Subscribe(0x1001, '/imu.orientation.y', Imu, scale=1000),
+    ice.Subscribe(0x1002, '/imu.orientation.z', Imu, scale=1000),
+])